@@ -7,9 +7,9 @@ from gpiozero import Button
 from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
 from gpiozero import Button
 from gpiozero import LED
-import random
 import os
 from collections import namedtuple
+from responses import UNIFORM, WEIGHTS, ResponseSelector
 from telegram.error import (TelegramError, Unauthorized, BadRequest,
                             TimedOut, ChatMigrated, NetworkError)
 # import logging
@@ -53,6 +53,8 @@ WARN_ADD_ANSWER = ("Hey! I'll only say this once. I'll be waiting for a reply, "
 TIME_AVOID_RING = 10
 TIME_AVOID_OPEN = 10
 OPEN_TIME_SLEEP = 0.3
+# uniform, weighted or shuffle, see responses.py
+RESPONSE_MODE = UNIFORM
 
 
 # responses for callback
@@ -155,6 +157,7 @@ class BotHandler:
                 RING: [],
                 OPEN: []
             }
+        self.rebuild_selectors()
 
         print_log("---NEW SESSION---")
         print_log(datetime.datetime.now())
@@ -384,6 +387,7 @@ class BotHandler:
             print_log(datetime.datetime.now())
             print_log(f"\tReloading {PATHS.RESPONSE_FILE} file...")
             self.responses = json.load(f)
+            self.rebuild_selectors()
             print_log("\tReloaded!")
 
         update.message.reply_text(f"reloaded configuration files!")
@@ -539,6 +543,7 @@ class BotHandler:
             if requested_action not in self.responses[action_to_names[requested_action]]:
                 self.responses[action_to_names[requested_action]].append(
                     update.message.text)
+                self.rebuild_selectors()
             update.message.reply_text(f"Your notification has been added!")
             print_log(datetime.datetime.now())
             print_log(
@@ -661,6 +666,7 @@ class BotHandler:
 
                 self.responses[context.user_data[LOCATION]].remove(
                     removed_response)
+                self.rebuild_selectors()
                 print_log(f"\tRemoved {removed_response}")
                 self.update_file(PATHS.RESPONSE_FILE, self.responses)
 
@@ -703,19 +709,21 @@ class BotHandler:
 
         return removed
 
+    def rebuild_selectors(self):
+        # whenever self.responses changes
+        weights = self.responses.get(WEIGHTS)
+        self.open_selector = ResponseSelector(
+            self.responses[OPEN], OPEN_PREFIX, OPEN_NOTIFICATION_FALLBACK,
+            RESPONSE_MODE, weights)
+        self.ring_selector = ResponseSelector(
+            self.responses[RING], RING_PREFIX, RING_NOTIFICATION_FALLBACK,
+            RESPONSE_MODE, weights)
+
     def selectOpen(self):
-        choice = random.choice(self.responses[OPEN])
-        if choice != None:
-            return OPEN_PREFIX + random.choice(self.responses[OPEN])
-        else:
-            return OPEN_PREFIX + OPEN_NOTIFICATION_FALLBACK
+        return self.open_selector.pick()
 
     def selectRing(self):
-        choice = random.choice(self.responses[RING])
-        if choice != None:
-            return RING_PREFIX + random.choice(self.responses[RING])
-        else:
-            return RING_PREFIX + RING_NOTIFICATION_FALLBACK
+        return self.ring_selector.pick()
 
     def update_file(self, file, obj):
         with open(file, 'w') as f:
@@ -1,15 +1,24 @@
+import time
+
+# the startup profile counts from here, before the heavy imports
+SCRIPT_START = time.time()
+
 import asyncio
 import datetime
 import html
+import importlib.util
 import json
 import os
 import random
 import signal
+import ssl
 import sys
-import time
 import traceback
+from collections import Counter, deque
+from urllib.parse import urlsplit
 
-from gpiozero import LED, Button
+import certifi
+import httpx
 from telegram import (
     CallbackQuery,
     InlineKeyboardButton,
@@ -21,28 +30,39 @@ from telegram.constants import ParseMode
 from telegram.error import (
     BadRequest,
     ChatMigrated,
+    Forbidden,
+    InvalidToken,
     NetworkError,
+    RetryAfter,
     TelegramError,
     TimedOut,
 )
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CallbackContext,
     CallbackQueryHandler,
     CommandHandler,
+    TypeHandler,
 )
 
-from utils import write_current_pid_in_file
+import metrics
+from logwriter import LogWriter
+from leader import LeaderLease, describe
+from outbound import ADMIN, ALERT, NAMES, URGENT, OutboundScheduler
+from responses import UNIFORM, WEIGHTS, ResponseSelector
+from storage import JSON, make_storage
+from tracing import Trace
+from utils import RING_REPORT_PATH, write_current_pid_in_file
 
 ENV_PROD = False
 
-if not ENV_PROD:
-    write_current_pid_in_file()
-
 MAX_LEN_TELEGRAM_MESSAGE = 3999
 PIN_OPEN = 4
 PIN_RING = 2
 # will call this pin even though the second one is gpio
+# name of the only gate when tokens.json doesn't list any
+DEFAULT_GATE = "cancello"
 
 CURRENT_DIR = os.path.dirname(__file__)
 # all relative to the SCRIPT, to avoid workdir hassle
@@ -54,12 +74,53 @@ class PATHS:
     LOG_FILE = "./log.txt"
     DEL_FILE = "./trash.txt"
     RESPONSE_FILE = "./responses.json"
-
-
-with open(PATHS.TOKEN_FILE) as f:
-    tokens = json.load(f)
+    TRACE_FILE = "./traces.jsonl"
+    DB_FILE = "./citofbot.db"
+    PENDING_FILE = "./pending_alerts.json"
+
+
+def load_tokens(path: str = PATHS.TOKEN_FILE):
+    # called from main, importing the module doesn't need the file
+    global TOKEN, DEVELOPER_CHAT_ID, BASE_URL, UPDATE_MODE, WEBHOOK
+    global METRICS_PORT, RESPONSE_MODE, STORAGE, STARTUP_PROFILE, HTTP
+    global COALESCE_RINGS, RENOTIFY_AFTER, GATES, LEADER_LOCK
+    with open(path) as f:
+        tokens = json.load(f)
     TOKEN = tokens["bot_token"]
     DEVELOPER_CHAT_ID = tokens["admin_chat_id"]
+    # optional, e.g. "http://127.0.0.1:8081/bot" for fake_telegram.py
+    BASE_URL = tokens.get("base_url")
+    # "polling" (default) or "webhook". webhook needs the "webhook" section:
+    # url, secret_token, and optionally listen, port, url_path, cert, key
+    UPDATE_MODE = tokens.get("mode", "polling")
+    WEBHOOK = tokens.get("webhook", {})
+    # prometheus text endpoint on localhost. null to turn it off
+    METRICS_PORT = tokens.get("metrics_port", 9464)
+    # uniform, weighted or shuffle, see responses.py
+    RESPONSE_MODE = tokens.get("response_mode", UNIFORM)
+    # "json" (config.json + responses.json) or "sqlite" (citofbot.db)
+    STORAGE = tokens.get("storage", JSON)
+    # true: the admin gets the time of every startup step, not just the total
+    STARTUP_PROFILE = tokens.get("startup_profile", False)
+    # outbound connection pool, all optional: pool_size, http2 (needs
+    # httpx[http2]), keepalive_expiry and keepalive_interval (null: no
+    # periodic warm up)
+    HTTP = tokens.get("http", {})
+    # true: a chat that still has an unanswered ring alert gets it edited
+    # ("rang 3x") instead of a new message. with renotify_after (seconds), an
+    # alert older than that is replaced by a new one, so the phone buzzes again
+    COALESCE_RINGS = tokens.get("coalesce_rings", False)
+    RENOTIFY_AFTER = tokens.get("renotify_after")
+    # one entry per gate: {"name": "car", "ring_pin": 17, "open_pin": 27},
+    # plus "mock": true to use fake devices for it. the first one is the
+    # default, for /open_gate without a name
+    GATES = tokens.get("gates") or [
+        {"name": DEFAULT_GATE, "ring_pin": PIN_RING, "open_pin": PIN_OPEN}
+    ]
+    # path of a lock file shared with a second instance: one runs the bot,
+    # the other stands by and takes over when it dies. null: just run
+    LEADER_LOCK = tokens.get("leader_lock")
+
 
 # responses and stuff
 FIRST_RUN = "Yo! Just woke up. Do you need something?"
@@ -71,6 +132,53 @@ DEFAULT_OPEN_NOTIFICATION = "WHO LET THE DOGS IN! WHO! WHO! whowho!"
 TIME_AVOID_RING = 15
 TIME_AVOID_OPEN = 10
 OPEN_TIME_SLEEP = 0.3
+# edges on the ring pin closer than this are one ring, bouncing
+RING_COALESCE_WINDOW = 2
+# max number of send_message calls in flight during a broadcast
+BROADCAST_CONCURRENCY = 8
+# calls to telegram in flight per priority class, see outbound.py
+OUTBOUND_BUDGETS = {URGENT: 4, ALERT: BROADCAST_CONCURRENCY, ADMIN: 2}
+# outbound connections: one per call the scheduler can have in flight. the
+# long poll has its own single connection, it never takes one of these
+HTTP_POOL_SIZE = sum(OUTBOUND_BUDGETS.values())
+# httpx closes idle connections after 5s by default, so every ring after a
+# quiet minute paid for a new tcp + tls handshake
+HTTP_KEEPALIVE_EXPIRY = 5 * 60
+# how often to check whether the outbound pool sat idle long enough that its
+# connections are about to expire, and warm them up again if so
+HTTP_KEEPALIVE_INTERVAL = 60
+# unanswered alerts older than this are forgotten
+PENDING_ALERT_TTL = 60 * 60
+# what alerts left over from before a restart become, if older than the TTL
+EXPIRED_ALERT = "Expired, nobody answered this ring"
+# what a coalesced alert becomes when a newer one replaces it
+REPLACED_ALERT = "Rang again, see below"
+# update latency (telegram timestamp -> handler) is logged every this many updates
+UPDATE_LATENCY_REPORT_EVERY = 10
+UPDATE_LATENCY_WINDOW = 100
+# unauthorized requests are summed up for the admin this often
+REJECTION_DIGEST_INTERVAL = 10 * 60
+# a chat rejected less than this long ago is only counted, nothing else
+REJECTION_CACHE_TTL = 5 * 60
+# identical errors (same type, same line) within this window are reported once
+ERROR_DEDUP_WINDOW = 5 * 60
+# full error reports waiting to be sent. more than this and they're dropped
+ERROR_BACKLOG = 20
+# our files that only pass bot api calls along, see error_fingerprint
+FINGERPRINT_SKIP_FILES = {"outbound.py"}
+# keeps the digest well below telegram's message size limit
+REJECTION_DIGEST_MAX_CHATS = 50
+# waiting for the network at startup: the delay between probes doubles from
+# the first to the max, with jitter
+BOOTSTRAP_FIRST_DELAY = 0.5
+BOOTSTRAP_MAX_DELAY = 4
+BOOTSTRAP_DNS_TIMEOUT = 5
+# rings that couldn't be sent (network down) are retried this often...
+OFFLINE_RETRY_INTERVAL = 10
+# ...and dropped when older than this, nobody needs to know about them anymore
+OFFLINE_RING_TTL = 15 * 60
+# how often a standby instance checks for changes the leader saved
+STANDBY_REFRESH = 5
 
 
 # responses for callback
@@ -78,6 +186,9 @@ RING = "ring_notifications"
 OPEN = "open_notifications"
 IGNORE = "ignore"
 
+# callback_data is "<gate>:<action>". buttons from before gates had no gate
+GATE_SEPARATOR = ":"
+
 CONFIRM = "confirm"
 QUIT = "quit"
 
@@ -95,6 +206,42 @@ WARN_RESPONSE = "warnResponse"
 ENABLED = "enabled"
 NAME = "name"
 
+LOG_WRITER = LogWriter(PATHS.LOG_FILE)
+
+RING_LATENCY = metrics.Histogram(
+    "citofbot_ring_latency_seconds", "gpio edge to broadcast complete"
+)
+LOCK_WAIT = metrics.Histogram(
+    "citofbot_lock_wait_seconds", "time handle_ring waits for the ring lock"
+)
+OPEN_LATENCY = metrics.Histogram(
+    "citofbot_open_gate_seconds", "open_gate end to end", ("result",)
+)
+API_LATENCY = metrics.Histogram(
+    "citofbot_api_call_seconds", "telegram bot api call time", ("method",)
+)
+API_FAILURES = metrics.Counter(
+    "citofbot_api_failures_total", "failed bot api calls", ("method", "error")
+)
+OUTBOUND_WAIT = metrics.Histogram(
+    "citofbot_outbound_wait_seconds",
+    "time a bot api call waits for its priority class",
+    ("priority",),
+)
+PENDING_ALERTS = metrics.Gauge("citofbot_pending_alerts", "unanswered ring alerts")
+ENABLED_CHATS = metrics.Gauge("citofbot_enabled_chats", "chats receiving alerts")
+# per gate. each gate's edges come from one thread, so no lost increments
+RING_EDGES = metrics.Counter(
+    "citofbot_ring_edges_total", "edges seen on the ring pin", labels=("gate",)
+)
+RINGS_ACCEPTED = metrics.Counter(
+    "citofbot_rings_accepted_total", "edges that became a ring", labels=("gate",)
+)
+# machine readable ring events for the load harness in utils.py. dev only
+REPORT_WRITER = None if ENV_PROD else LogWriter(RING_REPORT_PATH)
+# per-ring span timings, read them with trace_waterfall.py
+TRACE_WRITER = LogWriter(PATHS.TRACE_FILE)
+
 
 def print_log(message: str, level: int = 0, tag: str | int = None):
     if tag is not None:
@@ -110,8 +257,13 @@ def print_log(message: str, level: int = 0, tag: str | int = None):
         message = f"[{chat_name}] {message}"
     message = str(datetime.datetime.now()) + " " + "\t" * level + message
     print(message)
-    with open(PATHS.LOG_FILE, "a+") as f:
-        f.write(str(message) + "\n")
+    # goes through the background writer, never touches the disk from the loop
+    LOG_WRITER.write(message)
+
+
+def report_ring_event(**fields):
+    if REPORT_WRITER is not None:
+        REPORT_WRITER.write(json.dumps(fields))
 
 
 def save_state_factory(state):
@@ -127,64 +279,88 @@ def save_state_factory(state):
 
 
 def check_enabled(func):
-    async def inner(self, update, context):
-        src = str(update.effective_chat.id)
-        src_name = update.effective_chat.title or update.effective_chat.username
-        if src in self.conf.keys() and self.conf[src][ENABLED] == 1:
-            return await func(self, update, context)
+    async def inner(self, update, context, *args, **kwargs):
+        # O(1) against the precomputed index, no string conversion or conf lookups
+        if update.effective_chat.id in self.enabled_chats:
+            return await func(self, update, context, *args, **kwargs)
         else:
-            message = f"received unauthorized request from {src}({src_name})"
-            print_log(message)
-            await context.bot.send_message(
-                chat_id=DEVELOPER_CHAT_ID, text=message, parse_mode=ParseMode.HTML
-            )
+            # no message to the admin here, it goes in the periodic digest
+            self.rejections.record(update)
 
     return inner
 
 
 class BotHandler:
-    def __init__(self, open_dev, ring_dev, alwaysupdate=True):
-        try:
-            f = open(PATHS.CONF_FILE)
-            self.conf = json.load(f)
-            f.close()
-        except:
-            self.conf = {}
-
-        try:
-            f = open(PATHS.RESPONSE_FILE)
-            self.responses = json.load(f)
-            f.close()
-        except:
-            self.responses = {
-                RING: [DEFAULT_RING_NOTIFICATION],
-                OPEN: [DEFAULT_OPEN_NOTIFICATION],
-            }
-
+    def __init__(self, gates: list["Gate"], alwaysupdate=True, standby=False):
         print_log("---NEW SESSION---")
-        # all alerts sent but not answered. used when someone answer and
-        # everyone else sees the notification disappear
-        self.pending_alerts: list[Message] = []
-        # last time notification went out
-        self.lastring = 0
-        self.lastopen = 0
-        self.open_dev = open_dev
-        self.ring_dev = ring_dev
-        self.reply_to_ring = [
-            [
-                InlineKeyboardButton("Apri", callback_data=OPEN),
-                InlineKeyboardButton("Ignora", callback_data=IGNORE),
-            ]
-        ]
-        self.application = (
+        # the loop run_polling will use. made now, so edges from gpiozero's
+        # thread can be handed to it even before it runs
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        # json files (atomic, coalesced, off-loop saves, last good snapshot
+        # if one doesn't parse) or sqlite. only loading blocks, at startup
+        print_log(f"Using {STORAGE} storage", 1)
+        self.storage = make_storage(STORAGE, PATHS, log=print_log)
+        # a standby only reads: the files (and their .bak) are the leader's
+        self.conf = self.storage.load_conf(snapshot=not standby)
+        self.responses = self.storage.load_responses(
+            self.default_responses, snapshot=not standby
+        )
+        self.rebuild_selectors()
+        STARTUP.mark("config")
+
+        # ids of enabled chats, rebuilt whenever conf changes. conf_version
+        # goes up on every rebuild
+        self.enabled_chats: frozenset[int] = frozenset()
+        self.conf_version = 0
+        self.rebuild_auth_index()
+        # name -> gate, in config order. each one has its own lock, debounce
+        # times and pending alerts, see Gate
+        self.gates = {gate.name: gate for gate in gates}
+        self.default_gate = gates[0]
+        # pending alerts are saved on every change, so they survive a
+        # restart: the fresh ones are adopted right away, the old ones get
+        # expired by a background job
+        self.stale_alerts = self.restore_pending_alerts(snapshot=not standby)
+        request, get_updates_request = self.make_requests()
+        builder = (
             Application.builder()
             .token(TOKEN)
-            .read_timeout(30)
-            .write_timeout(30)
-            .build()
+            .request(request)
+            .get_updates_request(get_updates_request)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
         )
-        self.lock = asyncio.Lock()
+        if BASE_URL:
+            print_log(f"Using Bot API at {BASE_URL}", 1)
+            builder = builder.base_url(BASE_URL)
+        self.application = builder.build()
+        # every bot api call from here on goes through this, by priority
+        self.outbound = OutboundScheduler(
+            OUTBOUND_BUDGETS,
+            on_wait=lambda priority, waited: OUTBOUND_WAIT.observe(
+                waited, priority=NAMES[priority]
+            ),
+        )
+        # warm connections in the outbound pool. after a warm up failed,
+        # the next one that works means the network is back
+        self.warm_report = None
+        self.network_down = False
+        self.keepalive_interval = HTTP.get(
+            "keepalive_interval", HTTP_KEEPALIVE_INTERVAL
+        )
+        if self.keepalive_interval:
+            self.application.job_queue.run_repeating(
+                self.keep_warm, self.keepalive_interval, first=self.keepalive_interval
+            )
 
+        # runs before everything else, only to time how late updates arrive
+        self.update_latencies = deque(maxlen=UPDATE_LATENCY_WINDOW)
+        self.updates_seen = 0
+        self.update_mode = "polling"
+        self.application.add_handler(
+            TypeHandler(Update, self.measure_update_latency), group=-1
+        )
         self.application.add_handler(CommandHandler("addchat", self.add_to_conf))
         self.application.add_handler(
             CommandHandler("removechat", self.remove_from_conf)
@@ -196,12 +372,52 @@ class BotHandler:
         self.application.add_handler(CallbackQueryHandler(self.process_response))
         self.application.add_error_handler(self.process_error)
 
-        # set notification on signal received
-        self.ring_dev.when_pressed = lambda: self.application.job_queue.run_once(
-            self.handle_ring, 0
+        # set notification on signal received. edges are coalesced before
+        # they get anywhere near the job queue
+        for gate in gates:
+            gate.ring_intake = RingIntake(
+                lambda edge, at, gate=gate: self.loop.call_soon_threadsafe(
+                    self.schedule_ring, gate, edge, at
+                ),
+                name=gate.name,
+            )
+        if len(gates) > 1:
+            print_log(f"Gates: {', '.join(self.gates)}", 1)
+        # rings that come in before the job queue runs (e.g. waiting for the
+        # network after a power cut) wait here. None once it runs
+        self.ring_backlog: list | None = []
+        # how it went waiting for telegram to be reachable, for the admin
+        self.bootstrap_report = None
+        # set when this instance took over from another one, for the admin
+        self.failover_report = None
+        self.failover_event = None
+        # non zero when start() gave up for good, e.g. on a revoked token
+        self.exit_code = 0
+        # what the storage looked like when last loaded, see refresh_state
+        self.storage_version = self.storage.version()
+
+        PENDING_ALERTS.callback = lambda: sum(
+            len(gate.pending_alerts) for gate in gates
+        )
+        ENABLED_CHATS.callback = lambda: len(self.enabled_chats)
+        self.metrics_server = None
+
+        self.errors = ErrorReporter(self.application.bot, self.outbound)
+        self.application.job_queue.run_repeating(
+            self.send_error_digest, ERROR_DEDUP_WINDOW, first=ERROR_DEDUP_WINDOW
+        )
+        self.application.job_queue.run_repeating(
+            self.flush_offline_rings, OFFLINE_RETRY_INTERVAL
+        )
+        self.rejections = RejectionDigest()
+        self.application.job_queue.run_repeating(
+            self.send_rejection_digest,
+            REJECTION_DIGEST_INTERVAL,
+            first=REJECTION_DIGEST_INTERVAL,
         )
 
         self.alwaysupdate = alwaysupdate
+        STARTUP.mark("app build")
 
     async def process_error(self, update: Update, context: CallbackContext):
         print_log(f"error raised!: {context.error}")
@@ -217,42 +433,10 @@ class BotHandler:
             print_log("Message was edited twice... whatever", 1)
             return
 
-        # traceback.format_exception is list of strings.
-        tb_list = traceback.format_exception(
-            None, context.error, context.error.__traceback__
-        )
-        tb_string = "".join(tb_list)
-        # Build the message with some markup and additional information about what happened.
-        update_str = update.to_dict() if isinstance(update, Update) else str(update)
-        formatted_for_telegram, formatted_for_logs = self.format_error(
-            update_str, context, tb_string
-        )
+        # formatting and sending happen in the background, once per kind of
+        # error per window. the rest is counted and summed up in the digest
+        self.errors.report(update, context)
 
-        print_log(
-            f"updating developer with error details:\n*****\n{formatted_for_logs}\n****\n"
-        )
-        if len(formatted_for_telegram) > MAX_LEN_TELEGRAM_MESSAGE:
-            # then pick the version without tags, because sending a message without a closing
-            # tag makes telegram ANGRY
-            formatted_for_telegram = formatted_for_logs
-        messages_list = [
-            formatted_for_telegram[i : i + 4000]
-            for i in range(0, len(formatted_for_telegram), 4000)
-        ]
-        # Finally, send the message
-        try:
-            for i in messages_list:
-                await context.bot.send_message(
-                    chat_id=DEVELOPER_CHAT_ID, text=i, parse_mode=ParseMode.HTML
-                )
-        except Exception as e:
-            exc_type, exc_value, exc_traceback = sys.exc_info()
-            print_log(
-                "".join(traceback.format_exception(exc_type, exc_value, exc_traceback))
-            )
-            print_log(
-                "updating developer failed... network must be down. very sad! will not retry"
-            )
         try:
             raise context.error
         except BadRequest as e:
@@ -272,31 +456,48 @@ class BotHandler:
             pass
 
     @check_enabled
-    async def open_gate(self, update: Update, context):
-        print_log("Received request to open", 1, update)
-        if self.lastopen + TIME_AVOID_OPEN < time.time():
+    async def open_gate(self, update: Update, context, gate: "Gate" = None):
+        start = time.perf_counter()
+        if gate is None:
+            # /open_gate [name]
+            name = context.args[0] if context.args else self.default_gate.name
+            gate = self.gates.get(name)
+            if gate is None:
+                await self.reply(
+                    update, f"no gate called {name}, try one of: {', '.join(self.gates)}"
+                )
+                return
+        print_log(f"Received request to open {gate.name}", 1, update)
+        opened = gate.lastopen + TIME_AVOID_OPEN < time.time()
+        if opened:
             print_log("Last open time old enough, OPENING GATE...", 2, update)
-            self.open_dev.on()
-            time.sleep(OPEN_TIME_SLEEP)
-            self.open_dev.off()
+            # timed by the loop, so updates and rings keep flowing meanwhile
+            await gate.actuator.pulse()
             print_log("Signal sent. Is it open?", 2)
-            self.lastopen = time.time()
-            answer_message = self.selectOpenedResponse()
-            print_log("Clearing pending alerts...", 1)
-            for message in self.pending_alerts:
-                # check current content
-                await self.application.bot.edit_message_text(
-                    "Gate was opened", message.chat_id, message.message_id
-                )
-            self.pending_alerts.clear()
+            gate.lastopen = time.time()
+            self.storage.record_event(
+                "open", chat=update.effective_chat.id, gate=gate.name
+            )
+            answer_message = self.gate_text(gate, self.selectOpenedResponse())
         else:
             print_log(
                 f"Received 2 requests within {TIME_AVOID_OPEN} seconds; ignoring...", 2
             )
             answer_message = "It should still be open... relax"
 
-        sent_message = await self.application.bot.send_message(
-            update.effective_chat.id, answer_message, disable_notification=True
+        # the confirmation first, the one at the gate is waiting for it
+        sent_message = await self.outbound.call(
+            URGENT,
+            self.application.bot.send_message,
+            update.effective_chat.id,
+            answer_message,
+            disable_notification=True,
+        )
+        if opened:
+            print_log("Clearing pending alerts...", 1)
+            await self.retract_pending_alerts(gate, "Gate was opened")
+        OPEN_LATENCY.observe(
+            time.perf_counter() - start, result="opened" if opened else "too_soon"
         )
         print_log(
             f"Request handling complete. Response message id={sent_message.message_id}, to {update.effective_chat.id}\n\n",
@@ -304,36 +505,389 @@ class BotHandler:
             update,
         )
 
+    def make_requests(self):
+        # outbound calls and the long poll get separate pools, so a slow
+        # getUpdates never holds up a send and vice versa
+        pool_size = HTTP.get("pool_size", HTTP_POOL_SIZE)
+        http_version = "1.1"
+        if HTTP.get("http2"):
+            if importlib.util.find_spec("h2") is None:
+                print_log("HTTP/2 needs httpx[http2] (h2), staying on HTTP/1.1", 1)
+            else:
+                # one connection carries every call at once
+                http_version = "2"
+        self.warm_connections = 1 if http_version == "2" else min(
+            pool_size, OUTBOUND_BUDGETS[ALERT]
+        )
+        self.keepalive_expiry = HTTP.get("keepalive_expiry", HTTP_KEEPALIVE_EXPIRY)
+        print_log(f"Outbound pool: {pool_size} connections, HTTP/{http_version}", 1)
+        # loading the CA bundle is slow on the pi, both clients share one
+        # context instead of loading it once each
+        ssl_context = ssl.create_default_context(cafile=certifi.where())
+        request = TimedRequest(
+            connection_pool_size=pool_size,
+            read_timeout=30,
+            write_timeout=30,
+            http_version=http_version,
+            httpx_kwargs={
+                "verify": ssl_context,
+                # same as ptb's, plus a longer keepalive
+                "limits": httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+            },
+        )
+        # keep_warm looks at when it was last used
+        self.outbound_request = request
+        get_updates_request = TimedRequest(
+            read_timeout=30, write_timeout=30, httpx_kwargs={"verify": ssl_context}
+        )
+        return request, get_updates_request
+
+    async def prewarm(self):
+        # opens as many connections as a ring broadcast uses, all at once, so
+        # the handshakes are paid now instead of by the next ring. straight on
+        # the pool, not through the scheduler: a warm up never holds up a ring
+        # waiting for an alert slot. returns (cold call time, warm call time)
+        # in seconds
+        bot = self.application.bot
+
+        async def timed_get_me():
+            start = time.perf_counter()
+            await bot.get_me()
+            return time.perf_counter() - start
+
+        cold = await asyncio.gather(
+            *(timed_get_me() for _ in range(self.warm_connections))
+        )
+        # reuses one of the connections just opened
+        warm = await timed_get_me()
+        return sum(cold) / len(cold), warm
+
+    async def keep_warm(self, context):
+        # rings and replies keep the pool warm by themselves. only once it sat
+        # idle long enough that its connections would expire before the next
+        # check, they get used. while the network is down, every check tries
+        idle = time.monotonic() - self.outbound_request.last_used
+        # keepalive_expiry null: httpx never expires them
+        expiry = self.keepalive_expiry
+        expires_first = expiry is not None and idle + self.keepalive_interval >= expiry
+        if not (self.network_down or expires_first):
+            return
+        try:
+            await self.prewarm()
+        except TelegramError as e:
+            if not self.network_down:
+                print_log(f"Could not warm up connections: {e!r}", 1)
+            self.network_down = True
+            return
+        if self.network_down:
+            print_log("Network is back, connections warmed up again", 1)
+            self.network_down = False
+
+    def schedule_ring(self, gate: "Gate", edge: int, at: float):
+        # on the loop, so no races with release_ring_backlog
+        if self.ring_backlog is not None:
+            print_log(f"Ring {edge} at {gate.name} before the bot is up, kept for later", 1)
+            self.ring_backlog.append((gate, edge, at))
+            return
+        self.application.job_queue.run_once(
+            self.handle_ring,
+            0,
+            data={
+                "gate": gate,
+                "edge": edge,
+                "at": at,
+                # the trace starts here, at the edge
+                "trace": Trace(TRACE_WRITER, start=at),
+            },
+        )
+
+    async def release_ring_backlog(self, context):
+        # rings from while telegram was unreachable are old news: they go
+        # out like the ones missed in an outage, one "rang while I was
+        # offline" per chat, and only within OFFLINE_RING_TTL
+        backlog, self.ring_backlog = self.ring_backlog, None
+        if not backlog:
+            return
+        print_log(f"{len(backlog)} rings from before the bot was up, sent as missed", 1)
+        last = {}
+        for gate, edge, at in backlog:
+            # same debounce handle_ring would have done
+            if last.get(gate.name, 0) + TIME_AVOID_RING < at:
+                gate.offline_rings.add(self.enabled_chats, at)
+                last[gate.name] = at
+        await self.flush_offline_rings(context)
+
     async def handle_ring(self, context: CallbackContext):
         # when the doorbell rings, the bot receives many, many requests. to be able to
-        # distinguish their handling, i create a random int for each, to be attached to
-        # all subsequent logs related to this request
-        tag = str(random.randint(1, 100000))
-        print_log(f"Picked up signal, waiting for lock...", 1, tag)
-        async with self.lock:
+        # distinguish their handling, each gets a trace created at the gpio edge. its id
+        # is attached to all subsequent logs, and its spans time every step
+        edge = context.job.data
+        gate: Gate = edge["gate"]
+        trace: Trace = edge["trace"]
+        tag = trace.trace_id
+        trace.record("intake", edge["at"], edge=edge["edge"], gate=gate.name)
+        print_log(f"Picked up signal at {gate.name}, waiting for lock...", 1, tag)
+        waiting_since = time.perf_counter()
+        # each gate has its own lock, a ring here never waits for the others
+        with trace.span("lock_wait"):
+            await gate.lock.acquire()
+        try:
+            LOCK_WAIT.observe(time.perf_counter() - waiting_since)
             print_log("Lock acquired!...", 2, tag)
             print_log("Verifying...", 2, tag)
-            if self.lastring + TIME_AVOID_RING < time.time():
-                print_log("Last ring is old enough, alerting all chats...", 2)
-                await self.send_to_enabled()
-                self.lastring = time.time()
+            sent = []
+            alert = gate.lastring + TIME_AVOID_RING < time.time()
+            trace.record(
+                "debounce", time.time(), decision="alert" if alert else "suppressed"
+            )
+            if alert:
+                print_log("Last ring is old enough, alerting all chats...", 2, tag)
+                try:
+                    sent, failed = await self.ring_enabled(gate, trace)
+                except TelegramError as e:
+                    # something before the sends, nobody got it
+                    failed = {chat: e for chat in self.enabled_chats}
+                # even if it failed: every bounce retrying won't help, the
+                # missed ones get sent when the network is back
+                gate.lastring = time.time()
+                missed = [chat for chat, e in failed.items() if is_offline_error(e)]
+                if missed:
+                    gate.offline_rings.add(missed, edge["at"])
+                    print_log(f"Ring kept for {len(missed)} unreachable chats", 2, tag)
+                if sent:
+                    RING_LATENCY.observe(gate.lastring - edge["at"])
             else:
-                print_log("Too little time since last notification", 2)
-            print_log("Alert completed, back to idle...\n\n", 1, tag)
-
-    async def send_to_enabled(self, message=None):
-        enabled = {}
-        enabled = {
-            key: value for (key, value) in self.conf.items() if value[ENABLED] == 1
+                print_log("Too little time since last notification", 2, tag)
+            report_ring_event(
+                type="ring",
+                gate=gate.name,
+                edge=edge["edge"],
+                done=time.time(),
+                sent=len(sent),
+            )
+            self.storage.record_event(
+                "ring",
+                trace=tag,
+                gate=gate.name,
+                alerted=alert,
+                sent=len(sent),
+                edge_at=edge["at"],
+            )
+            trace.record("ring", edge["at"], sent=len(sent))
+            print_log(
+                f"Alert completed, back to idle. Edges so far: {gate.ring_intake.raw_edges} raw, {gate.ring_intake.accepted} accepted\n\n",
+                1,
+                tag,
+            )
+        finally:
+            gate.lock.release()
+
+    async def send_to_enabled(
+        self,
+        message=None,
+        trace: Trace = None,
+        priority: int = ALERT,
+        gate: "Gate" = None,
+        raise_if_unsent: bool = True,
+    ):
+        # no trace means a disabled one, spans go nowhere
+        trace = trace or Trace()
+        # pings and the start message come with the default gate's buttons
+        gate = gate or self.default_gate
+        enabled = self.enabled_chats
+        message = message or self.gate_text(gate, self.selectRing())
+        print_log(f"ALERTING enabled chats:{sorted(enabled)}", 2, trace.trace_id)
+        sent, failed = await self.broadcast(
+            enabled,
+            message,
+            trace=trace,
+            priority=priority,
+            reply_markup=gate.reply_markup,
+        )
+        # save them all to pending_alerts in one go
+        with trace.span("pending_alerts", added=len(sent)):
+            self.add_pending_alerts(gate, sent)
+        if raise_if_unsent and enabled and not sent:
+            # nobody got it, network must be down. let the error handler know
+            raise next(iter(failed.values()))
+        return sent, failed
+
+    async def ring_enabled(self, gate: "Gate", trace: Trace):
+        # a ring alert for every enabled chat. with coalescing, chats that
+        # still have an unanswered one from this gate get it edited (no new
+        # notification)
+        if not COALESCE_RINGS:
+            # the per chat errors decide which rings are kept for later, one
+            # exception for everybody would lose them
+            return await self.send_to_enabled(
+                trace=trace, gate=gate, raise_if_unsent=False
+            )
+        now = time.time()
+        line = self.gate_text(gate, self.selectRing())
+        enabled = self.enabled_chats
+        markup = gate.reply_markup
+        # answered, retracted or forgotten alerts are out
+        gate.ring_alerts = {
+            key: value
+            for key, value in gate.ring_alerts.items()
+            if key in gate.pending_alerts
         }
-        message = message or f"{self.selectRing()}"
-        print_log(f"ALERTING enabled chats:{str(enabled)}", 2)
-        for chat in enabled.keys():
-            # send message and save to pending_alerts
-            final_message = await self.application.bot.send_message(
-                chat, message, reply_markup=InlineKeyboardMarkup(self.reply_to_ring)
+        # the latest live ring alert of each chat
+        live = {key[0]: key for key in gate.ring_alerts if key[0] in enabled}
+        edits = {}
+        replaced = []
+        # chat -> number of rings the new alert is about
+        counts = {chat: 1 for chat in enabled if chat not in live}
+        for chat, key in live.items():
+            rings, notified_at = gate.ring_alerts[key]
+            if RENOTIFY_AFTER is not None and now - notified_at >= RENOTIFY_AFTER:
+                replaced.append(key)
+                counts[chat] = rings + 1
+            else:
+                edits[key] = coalesced_ring_text(line, rings + 1, now)
+
+        with trace.span("coalesce", edits=len(edits), new=len(counts)):
+            (sent, failed), (edited, edit_failed) = await asyncio.gather(
+                self.broadcast(
+                    counts,
+                    {
+                        chat: coalesced_ring_text(line, n, now)
+                        for chat, n in counts.items()
+                    },
+                    trace=trace,
+                    reply_markup=markup,
+                ),
+                self.edit_alerts(
+                    list(edits),
+                    edits,
+                    pending=gate.pending_alerts,
+                    reply_markup=markup,
+                ),
+            )
+            # an edit that can't work (message deleted...) becomes a new alert
+            retry = {}
+            for (chat, message_id), e in edit_failed.items():
+                if is_offline_error(e):
+                    failed[chat] = e
+                else:
+                    gate.pending_alerts.pop((chat, message_id), None)
+                    retry[chat] = gate.ring_alerts.pop((chat, message_id))[0] + 1
+            if retry:
+                more_sent, more_failed = await self.broadcast(
+                    retry,
+                    {
+                        chat: coalesced_ring_text(line, n, now)
+                        for chat, n in retry.items()
+                    },
+                    trace=trace,
+                    reply_markup=markup,
+                )
+                sent += more_sent
+                failed.update(more_failed)
+                counts.update(retry)
+
+        self.add_pending_alerts(gate, sent)
+        for message in sent:
+            gate.ring_alerts[(message.chat_id, message.message_id)] = [
+                counts[message.chat_id],
+                now,
+            ]
+        for message in edited:
+            key = (message.chat_id, message.message_id)
+            if key not in gate.pending_alerts:
+                # answered or retracted while the edit was out, it stays that way
+                continue
+            gate.ring_alerts[key][0] += 1
+            # live again: to the back of the TTL queue
+            gate.pending_alerts.pop(key, None)
+            gate.pending_alerts[key] = now
+        self.save_pending_alerts()
+        print_log(
+            f"Coalescing: {len(edited)} alerts edited, {len(sent)} sent",
+            2,
+            trace.trace_id,
+        )
+        if replaced:
+            # the new ones went out, the old ones lose their buttons
+            for key in replaced:
+                gate.pending_alerts.pop(key, None)
+                gate.ring_alerts.pop(key, None)
+            await self.edit_alerts(replaced, REPLACED_ALERT)
+        return sent + edited, failed
+
+    async def broadcast(
+        self, chats, text, trace: Trace = None, priority: int = ALERT, **kwargs
+    ):
+        # sends to all chats at once, as many in flight as the priority class
+        # allows. a failing chat doesn't stop the others
+        trace = trace or Trace()
+        chats = list(chats)
+
+        async def send_one(chat):
+            queued_at = time.time()
+            async with self.outbound.slot(priority):
+                with trace.span("send", chat=chat, queued=time.time() - queued_at):
+                    # text can also be chat -> its own text
+                    return await self.application.bot.send_message(
+                        chat, text[chat] if isinstance(text, dict) else text, **kwargs
+                    )
+
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(send_one(chat) for chat in chats), return_exceptions=True
+        )
+        elapsed = time.perf_counter() - start
+        sent = []
+        failed = {}
+        for chat, result in zip(chats, results):
+            if isinstance(result, Exception):
+                print_log(f"Sending to {chat} failed: {result!r}", 2, trace.trace_id)
+                failed[chat] = result
+            else:
+                sent.append(result)
+        print_log(
+            f"Broadcast reached {len(sent)}/{len(chats)} chats in {elapsed:.3f}s",
+            2,
+            trace.trace_id,
+        )
+        return sent, failed
+
+    async def flush_offline_rings(self, context):
+        # one message per chat with all the rings it missed, once telegram
+        # answers again
+        if not any(gate.offline_rings for gate in self.gates.values()):
+            return
+        try:
+            # one cheap call per try while still offline, not one per chat
+            await self.outbound.call(ALERT, context.bot.get_me)
+        except TelegramError:
+            return
+        for gate in self.gates.values():
+            if not gate.offline_rings:
+                continue
+            missed = gate.offline_rings.take()
+            if not missed:
+                print_log(f"Network is back, missed rings at {gate.name} were too old to send", 1)
+                continue
+            print_log(
+                f"Network is back, sending missed rings at {gate.name} to {len(missed)} chats",
+                1,
+            )
+            texts = {
+                chat: self.gate_text(gate, missed_rings_text(times))
+                for chat, times in missed.items()
+            }
+            sent, failed = await self.broadcast(
+                missed, texts, reply_markup=gate.reply_markup
             )
-            self.pending_alerts.append(final_message)
+            self.add_pending_alerts(gate, sent)
+            for chat, e in failed.items():
+                if is_offline_error(e):
+                    gate.offline_rings.put_back(chat, missed[chat])
 
     @check_enabled
     async def process_response(self, update, context):
@@ -341,9 +895,16 @@ class BotHandler:
         print_log("Received callback query...", 1)
         await self.clean_query_remove_markup(update.callback_query)
 
-        if query.data == OPEN:
-            print_log("... to open the gate...", 2)
-            await self.open_gate(update, context)
+        # "<gate>:<action>". alerts sent before gates had just the action,
+        # those are for the default gate
+        name, _, action = query.data.rpartition(GATE_SEPARATOR)
+        if action == OPEN:
+            gate = self.gates.get(name) if name else self.default_gate
+            if gate is None:
+                print_log(f"... to open {name}, which is gone. Ignored.", 2)
+                return
+            print_log(f"... to open {gate.name}...", 2)
+            await self.open_gate(update, context, gate)
         else:
             print_log("... to ignore. Ignored.", 2)
 
@@ -355,19 +916,19 @@ class BotHandler:
         added = self.addChat(update.effective_chat.id, name)
         print_log("Done!", 1)
         if self.alwaysupdate and added:
-            self.update_file(PATHS.CONF_FILE, self.conf)
+            chat_id = str(update.effective_chat.id)
+            self.storage.save_chat(chat_id, self.conf[chat_id])
         if added:
-            await update.message.reply_text(
-                "added your chat. it'll have to be verified by a moderator before you're clear!"
+            await self.reply(
+                update,
+                "added your chat. it'll have to be verified by a moderator before you're clear!",
             )
         else:
-            await update.message.reply_text("I already added your chat")
+            await self.reply(update, "I already added your chat")
 
     async def remove_from_conf(self, update, context):
         if self.conf is {}:
-            await update.message.reply_text(
-                "i'm not sending updates to anyone right now..."
-            )
+            await self.reply(update, "i'm not sending updates to anyone right now...")
             print_log("No keys in dict")
             return
         print_log("Removing chat...", 1)
@@ -375,50 +936,284 @@ class BotHandler:
         print_log("Done!", 1)
         if update.message is not None:
             if removed:
-                await update.message.reply_text(
-                    "removed this chat! you'll no longer receive notifications from me"
+                await self.reply(
+                    update,
+                    "removed this chat! you'll no longer receive notifications from me",
                 )
             else:
-                await update.message.reply_text(
-                    "chat not found. are you sure you know what you're doing?"
+                await self.reply(
+                    update, "chat not found. are you sure you know what you're doing?"
                 )
 
     async def reload_settings(self, update, context):
         print_log("Received reload request")
 
-        with open(PATHS.CONF_FILE) as f:
-            print_log(f"Reloading {PATHS.CONF_FILE} file...", 1)
-            self.conf = json.load(f)
-            print_log("Reloaded!", 1)
+        print_log("Reloading chats...", 1)
+        # edited by hand (the file or the db), that wins over unsaved changes
+        self.conf = await self.storage.reload_conf()
+        self.rebuild_auth_index()
+        print_log("Reloading responses...", 1)
+        self.responses = await self.storage.reload_responses(self.default_responses)
+        self.rebuild_selectors()
+        print_log("Reloaded!", 1)
 
-        await update.message.reply_text("reloaded configuration files!")
+        await self.reply(update, "reloaded configuration files!")
 
     @check_enabled
     async def ping_all(self, update: Update, context):
         print_log(
             f"pinging all because of message from {update.effective_chat.id}, {update.effective_chat.full_name}"
         )
-        await self.send_to_enabled(message="PING!")
-        await update.message.reply_text("did you get pinged?")
+        await self.send_to_enabled(message="PING!", priority=ADMIN)
+        await self.reply(update, "did you get pinged?")
+
+    async def reply(self, update: Update, text: str):
+        # command replies are never urgent
+        await self.outbound.call(ADMIN, update.message.reply_text, text)
+
+    async def send_error_digest(self, context):
+        digest = self.errors.digest()
+        if digest is not None:
+            print_log(f"Error digest:\n{digest}", 1)
+            await self.outbound.call(
+                ADMIN, context.bot.send_message, chat_id=DEVELOPER_CHAT_ID, text=digest
+            )
+
+    async def send_rejection_digest(self, context):
+        digest = self.rejections.digest()
+        if digest is not None:
+            print_log("Sending unauthorized requests digest", 1)
+            await self.outbound.call(
+                ADMIN, context.bot.send_message, chat_id=DEVELOPER_CHAT_ID, text=digest
+            )
 
     async def first_message(self, context):
+        try:
+            cold, warm = await self.prewarm()
+            self.warm_report = (
+                f"Warmed up {self.warm_connections} connections: a cold call took "
+                f"{cold:.3f}s, a warm one {warm:.3f}s"
+            )
+            if cold > warm:
+                self.warm_report += f", {cold - warm:.3f}s saved on the first ring"
+        except TelegramError as e:
+            self.warm_report = f"Could not warm up connections: {e!r}"
+        print_log(self.warm_report, 1)
         print_log("Sending start message...")
-        await self.send_to_enabled(FIRST_RUN)
+        await self.send_to_enabled(FIRST_RUN, priority=ADMIN)
         print_log("Sent start message.", 1)
-        await context.bot.send_message(
-            chat_id=DEVELOPER_CHAT_ID,
-            text=f"Bot started. Since script start it's been {round(elapsed,3)} seconds.",
+        STARTUP.mark("first message")
+        print_log(f"Startup profile:\n{STARTUP.report()}", 1)
+        text = (
+            f"Bot started. Since script start it's been "
+            f"{round(STARTUP.elapsed('first message'), 3)} seconds."
+        )
+        if STARTUP_PROFILE:
+            text += "\n" + STARTUP.report()
+        if self.bootstrap_report is not None:
+            text += "\n" + self.bootstrap_report
+        if self.failover_report is not None:
+            # until the first poll, nobody was answering buttons
+            back = STARTUP.marks.get("first poll", time.time()) - STARTUP.marks["leader"]
+            text += f"\n{self.failover_report}, polling again {back:.2f}s later"
+            self.storage.record_event("failover", back=back, **self.failover_event)
+        text += "\n" + self.warm_report
+        await self.outbound.call(
+            ADMIN, context.bot.send_message, chat_id=DEVELOPER_CHAT_ID, text=text
         )
         print_log("Admin updated", 1)
 
+    async def measure_update_latency(self, update: Update, context):
+        # callback queries carry no date, only messages can be timed. telegram
+        # dates are whole seconds, so this is only meaningful as an average
+        if update.message is None:
+            return
+        self.update_latencies.append(time.time() - update.message.date.timestamp())
+        self.updates_seen += 1
+        if self.updates_seen % UPDATE_LATENCY_REPORT_EVERY == 0:
+            latencies = self.update_latencies
+            print_log(
+                f"Update latency ({self.update_mode}, last {len(latencies)}): "
+                f"mean {sum(latencies) / len(latencies):.3f}s, max {max(latencies):.3f}s",
+                1,
+            )
+
+    def webhook_ready(self):
+        # startup check. anything missing -> log it and fall back to polling
+        problems = []
+        if importlib.util.find_spec("tornado") is None:
+            problems.append('missing python-telegram-bot[webhooks] (tornado)')
+        if not WEBHOOK.get("url"):
+            problems.append("no webhook url")
+        secret = WEBHOOK.get("secret_token") or ""
+        if not (
+            1 <= len(secret) <= 256
+            and all(c.isascii() and (c.isalnum() or c in "_-") for c in secret)
+        ):
+            problems.append("secret_token must be 1-256 chars of A-Z, a-z, 0-9, _ and -")
+        for problem in problems:
+            print_log(f"Webhook mode unavailable: {problem}", 1)
+        return not problems
+
+    async def check_webhook(self, context):
+        info = await self.outbound.call(ADMIN, context.bot.get_webhook_info)
+        message = (
+            f"Webhook check: url={info.url!r}, pending={info.pending_update_count}, "
+            f"last error={info.last_error_message!r}"
+        )
+        print_log(message, 1)
+        if info.url != WEBHOOK["url"]:
+            await self.outbound.call(
+                ADMIN,
+                context.bot.send_message,
+                chat_id=DEVELOPER_CHAT_ID,
+                text=f"Webhook not registered as expected!\n{message}",
+            )
+
+    async def wait_for_telegram(self):
+        # after a power cut the pi is up long before the router and the nas
+        # doing dns. probe here, with the gpio alive and rings kept for later,
+        # instead of letting systemd restart the whole thing every 30s
+        host = urlsplit(BASE_URL or "https://api.telegram.org").hostname
+        start = time.time()
+        failures = []
+        delay = BOOTSTRAP_FIRST_DELAY
+        while True:
+            step = "dns"
+            try:
+                await asyncio.wait_for(
+                    self.loop.getaddrinfo(host, None), BOOTSTRAP_DNS_TIMEOUT
+                )
+                step = "get_me"
+                # what application.initialize() would do first anyway. once
+                # it worked, the bot is initialized and that one is a no-op
+                await self.application.bot.initialize()
+                break
+            except (InvalidToken, Forbidden):
+                # telegram answered, and said no: waiting won't fix the token
+                raise
+            except (OSError, asyncio.TimeoutError, TelegramError) as e:
+                failures.append((step, type(e).__name__))
+                # half fixed, half random, so a house full of devices coming
+                # back up doesn't retry in lockstep
+                wait = delay / 2 + random.uniform(0, delay / 2)
+                print_log(
+                    f"Telegram not reachable ({step}: {e!r}), "
+                    f"attempt {len(failures)}, retrying in {wait:.2f}s",
+                    1,
+                )
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, BOOTSTRAP_MAX_DELAY)
+        elapsed = time.time() - start
+        if failures:
+            summary = ", ".join(
+                f"{step} {error} x{count}"
+                for (step, error), count in Counter(failures).items()
+            )
+            self.bootstrap_report = (
+                f"Telegram reachable after {len(failures) + 1} attempts "
+                f"and {elapsed:.1f}s. Failed: {summary}"
+            )
+        else:
+            self.bootstrap_report = f"Telegram reachable at first try, {elapsed:.3f}s"
+        print_log(self.bootstrap_report, 1)
+
+    def stand_by(self, lease: LeaderLease):
+        # blocks while another instance is the leader, keeping conf,
+        # responses and pending alerts in sync with what it writes. True once
+        # this one is the leader, False if interrupted first
+        print_log(f"Standing by, {describe(lease.read())} is the leader")
+        try:
+            lease.wait(on_idle=self.refresh_state, idle_interval=STANDBY_REFRESH)
+        except KeyboardInterrupt:
+            print_log("Interrupted while standing by")
+            return False
+        self.take_over(lease)
+        return True
+
+    def refresh_state(self):
+        # the leader saves on every change. only reloads if something did
+        # change, and never writes: the .bak snapshots are the leader's
+        version = self.storage.version()
+        if version == self.storage_version:
+            return
+        self.storage_version = version
+        self.conf = self.storage.load_conf(snapshot=False)
+        self.rebuild_auth_index()
+        self.responses = self.storage.load_responses(
+            self.default_responses, snapshot=False
+        )
+        self.rebuild_selectors()
+        for gate in self.gates.values():
+            gate.pending_alerts.clear()
+        self.stale_alerts = self.restore_pending_alerts(snapshot=False)
+
+    def take_over(self, lease: LeaderLease):
+        # the last writes of the old leader, then the same startup as always
+        self.refresh_state()
+        STARTUP.mark("leader")
+        previous = lease.previous
+        if previous is None:
+            return
+        # a crashed leader died at most a renewal interval after the last one
+        released = previous.get("released_at")
+        last_seen = released or previous["renewed_at"]
+        self.failover_report = (
+            f"Took over from {describe(previous)}, which "
+            f"{'stopped' if released else 'died'}: lock taken "
+            f"{lease.acquired_at - last_seen:.2f}s after its last lease renewal"
+        )
+        print_log(self.failover_report)
+        self.failover_event = {
+            "previous": previous["pid"],
+            "released": released is not None,
+            "gap": lease.acquired_at - last_seen,
+        }
+
     def start(self):
-        self.application.run_polling()
+        try:
+            self.loop.run_until_complete(self.wait_for_telegram())
+        except KeyboardInterrupt:
+            print_log("Interrupted while waiting for telegram")
+            return
+        except (InvalidToken, Forbidden) as e:
+            print_log(
+                f"Telegram refused the bot token ({e!r}). "
+                f"Check {PATHS.TOKEN_FILE}, not retrying",
+                1,
+            )
+            self.exit_code = 1
+            return
+        self.update_mode = "polling"
+        if UPDATE_MODE == "webhook":
+            if self.webhook_ready():
+                self.update_mode = "webhook"
+            else:
+                print_log("Falling back to polling", 1)
+        if self.update_mode == "webhook":
+            listen = WEBHOOK.get("listen", "127.0.0.1")
+            port = WEBHOOK.get("port", 8443)
+            print_log(f"Starting webhook on {listen}:{port} for {WEBHOOK['url']}")
+            self.application.job_queue.run_once(self.check_webhook, 0)
+            self.application.run_webhook(
+                listen=listen,
+                port=port,
+                url_path=WEBHOOK.get("url_path", ""),
+                cert=WEBHOOK.get("cert"),
+                key=WEBHOOK.get("key"),
+                webhook_url=WEBHOOK["url"],
+                # telegram sends it in a header, ptb drops requests without it
+                secret_token=WEBHOOK["secret_token"],
+            )
+        else:
+            self.application.run_polling()
 
     def addChat(self, chat_id, chat_name):
         chat_id = str(chat_id)
         added = False
         if chat_id not in self.conf:
             self.conf[chat_id] = {NAME: chat_name, ENABLED: 0}
+            self.rebuild_auth_index()
             added = True
             print_log("Added new chat to conf", 2, chat_name)
         else:
@@ -430,99 +1225,726 @@ class BotHandler:
         removed = False
         if chat_id in self.conf:
             self.conf.pop(chat_id)
+            self.rebuild_auth_index()
             removed = True
             print_log("Removed chat", 2)
         else:
             print_log("Chat wasn't in conf...", 2)
         if removed and self.alwaysupdate:
-            self.update_file(PATHS.CONF_FILE, self.conf)
+            self.storage.remove_chat(chat_id)
 
         return removed
 
+    def rebuild_auth_index(self):
+        self.enabled_chats = frozenset(
+            int(key) for (key, value) in self.conf.items() if value[ENABLED] == 1
+        )
+        self.conf_version += 1
+        print_log(
+            f"Auth index v{self.conf_version}: {len(self.enabled_chats)} enabled chats",
+            2,
+        )
+
+    @staticmethod
+    def default_responses():
+        return {
+            RING: [DEFAULT_RING_NOTIFICATION],
+            OPEN: [DEFAULT_OPEN_NOTIFICATION],
+        }
+
+    def rebuild_selectors(self):
+        # whenever self.responses changes
+        weights = self.responses.get(WEIGHTS)
+        self.open_selector = ResponseSelector(
+            self.responses.get(OPEN, []),
+            OPEN_PREFIX,
+            DEFAULT_OPEN_NOTIFICATION,
+            RESPONSE_MODE,
+            weights,
+        )
+        self.ring_selector = ResponseSelector(
+            self.responses.get(RING, []),
+            RING_PREFIX,
+            DEFAULT_RING_NOTIFICATION,
+            RESPONSE_MODE,
+            weights,
+        )
+
     def selectOpenedResponse(self):
-        choice = random.choice(self.responses[OPEN])
-        if choice != None:
-            return OPEN_PREFIX + random.choice(self.responses[OPEN])
-        else:
-            return OPEN_PREFIX + DEFAULT_OPEN_NOTIFICATION
+        return self.open_selector.pick()
 
     def selectRing(self):
-        choice = random.choice(self.responses[RING])
-        if choice != None:
-            return RING_PREFIX + random.choice(self.responses[RING])
-        else:
-            return RING_PREFIX + DEFAULT_RING_NOTIFICATION
-
-    def update_file(self, file, obj):
-        with open(file, "w") as f:
-            print_log("Saving to file..", 2)
-            # consider sort_keys=True
-            json.dump(obj, f, indent=4)
-            print_log("Saved!", 2)
+        return self.ring_selector.pick()
+
+    def gate_text(self, gate: "Gate", text: str):
+        # with one gate, messages stay the way they always were. with more,
+        # the gate's name takes the place of the ring prefix (a fixed
+        # "[cancello]"), other messages get it in front
+        if len(self.gates) == 1:
+            return text
+        if text.startswith(RING_PREFIX):
+            return f"[{gate.name}]{text[len(RING_PREFIX):]}"
+        return f"({gate.name}) {text}"
+
+    async def post_init(self, application: Application):
+        # scheduled only now, once telegram is reachable. jobs scheduled
+        # earlier would be skipped as missed, after a long wait for the network
+        application.job_queue.run_once(self.release_ring_backlog, 0)
+        application.job_queue.run_once(self.first_message, 0)
+        if self.stale_alerts:
+            application.job_queue.run_once(self.expire_stale_alerts, 0)
+        self.errors.start(application)
+        if METRICS_PORT:
+            self.metrics_server = await metrics.serve("127.0.0.1", METRICS_PORT)
+            print_log(f"Metrics on http://127.0.0.1:{METRICS_PORT}/metrics", 1)
+
+    async def post_shutdown(self, application: Application):
+        await self.errors.stop()
+        await self.flush_stores()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+
+    async def flush_stores(self, application=None):
+        print_log("Flushing pending saves...", 1)
+        await self.storage.close()
+        print_log("Saved.", 2)
 
     async def clean_query_remove_markup(self, query: CallbackQuery):
         if query != None:
-            await query.answer()
-            await query.edit_message_text(text="Selected option: {}".format(query.data))
-            # remove it from pending, it's been handled
-            for message in self.pending_alerts:
-                if message.message_id == query.message.message_id:
-                    self.pending_alerts.remove(message)
+            # out of pending first, so a ring edit still queued for it skips it
+            key = (query.message.chat_id, query.message.message_id)
+            for gate in self.gates.values():
+                if gate.pending_alerts.pop(key, None) is not None:
+                    self.save_pending_alerts()
                     break
+            await self.outbound.call(URGENT, query.answer)
+            await self.outbound.call(
+                URGENT,
+                query.edit_message_text,
+                # without the gate, like before gates
+                text="Selected option: {}".format(
+                    query.data.rpartition(GATE_SEPARATOR)[2]
+                ),
+            )
+
+    def save_pending_alerts(self):
+        self.storage.save_pending_alerts(
+            {gate.name: gate.pending_alerts for gate in self.gates.values()}
+        )
+
+    def add_pending_alerts(self, gate: "Gate", messages: list[Message]):
+        now = time.time()
+        self.evict_stale_alerts(gate, now)
+        for message in messages:
+            gate.pending_alerts[(message.chat_id, message.message_id)] = now
+        self.save_pending_alerts()
+
+    def restore_pending_alerts(self, snapshot: bool = True):
+        # adopts the saved alerts still within the TTL, returns the others.
+        # alerts saved before gates existed ("") are the default gate's, the
+        # ones of a gate that's not configured anymore just get expired
+        now = time.time()
+        stale = []
+        restored = 0
+        saved = self.storage.load_pending_alerts(snapshot)
+        for name, alerts in saved.items():
+            gate = self.gates.get(name) if name else self.default_gate
+            for key, sent_at in sorted(alerts.items(), key=lambda item: item[1]):
+                if gate is None or sent_at + PENDING_ALERT_TTL < now:
+                    stale.append(key)
+                else:
+                    gate.pending_alerts[key] = sent_at
+                    restored += 1
+        if saved:
+            print_log(
+                f"Restored {restored} pending alerts, {len(stale)} to expire", 1
+            )
+        return stale
+
+    async def expire_stale_alerts(self, context):
+        # their buttons are still live in the chats. runs as its own job,
+        # a ring coming in meanwhile doesn't wait for it
+        alerts, self.stale_alerts = self.stale_alerts, []
+        start = time.perf_counter()
+        _, failed = await self.edit_alerts(alerts, EXPIRED_ALERT, priority=ADMIN)
+        # the saved copy still had them
+        self.save_pending_alerts()
+        print_log(
+            f"Expired {len(alerts) - len(failed)}/{len(alerts)} alerts from before "
+            f"the restart in {time.perf_counter() - start:.3f}s",
+            1,
+        )
+
+    def evict_stale_alerts(self, gate: "Gate", now: float = None):
+        now = now or time.time()
+        evicted = 0
+        # oldest first, so stop at the first one still fresh
+        while gate.pending_alerts:
+            key, sent_at = next(iter(gate.pending_alerts.items()))
+            if sent_at + PENDING_ALERT_TTL >= now:
+                break
+            del gate.pending_alerts[key]
+            evicted += 1
+        if evicted:
+            print_log(f"Forgot {evicted} unanswered alerts older than TTL", 2)
+
+    async def retract_pending_alerts(self, gate: "Gate", text: str):
+        # edits every pending alert of the gate at once. one failing edit
+        # (deleted message, chat gone...) doesn't stop the others
+        self.evict_stale_alerts(gate)
+        alerts = list(gate.pending_alerts)
+        gate.pending_alerts.clear()
+        self.save_pending_alerts()
+        _, failed = await self.edit_alerts(alerts, text)
+        print_log(
+            f"Retracted {len(alerts) - len(failed)}/{len(alerts)} pending alerts", 2
+        )
+
+    async def edit_alerts(
+        self,
+        alerts: list[tuple[int, int]],
+        text: str | dict,
+        priority: int = ALERT,
+        pending: dict = None,
+        **kwargs,
+    ):
+        # all at once, as many in flight as the priority class allows. text
+        # can also be alert -> its own text. with pending, an alert that's not
+        # in it anymore when its turn comes (answered, retracted) is left
+        # alone. returns the edited messages and alert -> error for the ones
+        # that failed
+        async def edit_one(alert):
+            async with self.outbound.slot(priority):
+                if pending is not None and alert not in pending:
+                    return None
+                return await self.application.bot.edit_message_text(
+                    text[alert] if isinstance(text, dict) else text,
+                    *alert,
+                    **kwargs,
+                )
 
-    def format_error(self, update_str, context, tb_string):
-        telegram_message = (
-            "An exception was raised while handling an update\n"
-            f"<pre>update = {html.escape(json.dumps(update_str, indent=2, ensure_ascii=False))}</pre>\n\n"
-            f"<pre>context.chat_data = {html.escape(str(context.chat_data))}</pre>\n\n"
-            f"<pre>context.user_data = {html.escape(str(context.user_data))}</pre>\n\n"
-            f"<pre>{html.escape(tb_string)}</pre>"
+        results = await asyncio.gather(
+            *(edit_one(alert) for alert in alerts), return_exceptions=True
         )
-        log_message = (
-            "An exception was raised while handling an update\n"
-            f"update = {json.dumps(update_str, indent=2, ensure_ascii=False)}\n"
-            f"context.chat_data = {str(context.chat_data)}\n\n"
-            f"context.user_data = {str(context.user_data)}\n\n" + tb_string
+        edited = []
+        failed = {}
+        for (chat_id, message_id), result in zip(alerts, results):
+            if isinstance(result, Exception):
+                failed[(chat_id, message_id)] = result
+                print_log(
+                    f"Could not edit alert {message_id} in {chat_id}: {result!r}", 2
+                )
+            elif result is not None:
+                edited.append(result)
+        return edited, failed
+
+
+def format_error(update_str, chat_data: str, user_data: str, tb_string):
+    telegram_message = (
+        "An exception was raised while handling an update\n"
+        f"<pre>update = {html.escape(json.dumps(update_str, indent=2, ensure_ascii=False))}</pre>\n\n"
+        f"<pre>context.chat_data = {html.escape(chat_data)}</pre>\n\n"
+        f"<pre>context.user_data = {html.escape(user_data)}</pre>\n\n"
+        f"<pre>{html.escape(tb_string)}</pre>"
+    )
+    log_message = (
+        "An exception was raised while handling an update\n"
+        f"update = {json.dumps(update_str, indent=2, ensure_ascii=False)}\n"
+        f"context.chat_data = {chat_data}\n\n"
+        f"context.user_data = {user_data}\n\n" + tb_string
+    )
+    return telegram_message, log_message
+
+
+def is_offline_error(error: BaseException):
+    # worth retrying later. BadRequest is a NetworkError for ptb, but it's
+    # not going to get better
+    return isinstance(error, (NetworkError, RetryAfter)) and not isinstance(
+        error, BadRequest
+    )
+
+
+def coalesced_ring_text(line: str, rings: int, last: float):
+    if rings == 1:
+        return line
+    last = datetime.datetime.fromtimestamp(last)
+    return f"{line}\nrang {rings}× — last at {last:%H:%M:%S}"
+
+
+def missed_rings_text(times: list[float]):
+    first = datetime.datetime.fromtimestamp(times[0])
+    if len(times) == 1:
+        return f"{RING_PREFIX} doorbell rang at {first:%H:%M:%S}, while I was offline"
+    last = datetime.datetime.fromtimestamp(times[-1])
+    return (
+        f"{RING_PREFIX} doorbell rang {len(times)} times between "
+        f"{first:%H:%M} and {last:%H:%M}, while I was offline"
+    )
+
+
+def error_fingerprint(error: BaseException):
+    # type + where it was raised in our code (the innermost frame would be
+    # deep in ptb/httpx for anything network related, same for every call).
+    # the wrappers every bot api call goes through don't count either, or
+    # all telegram errors would look like they came from the same line
+    tb = error.__traceback__
+    if tb is None:
+        return f"{type(error).__name__} (no traceback)"
+    here = os.path.abspath(CURRENT_DIR) + os.sep
+    wrappers = (TimedRequest.post.__code__, BotHandler.reply.__code__)
+    ours = innermost = None
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        filename = code.co_filename
+        innermost = f"{os.path.basename(filename)}:{tb.tb_lineno}"
+        path = os.path.abspath(filename)
+        if (
+            path.startswith(here)
+            # a virtualenv inside the checkout isn't our code
+            and "site-packages" not in path
+            and "dist-packages" not in path
+            and os.path.basename(filename) not in FINGERPRINT_SKIP_FILES
+            and code not in wrappers
+        ):
+            ours = innermost
+        tb = tb.tb_next
+    return f"{type(error).__name__} at {ours or innermost}"
+
+
+class ErrorReporter:
+    # first error of each fingerprint in a window gets the full report, built
+    # in a worker thread and sent by a background task. repeats are counted
+    # and summed up in one digest. the backlog of full reports is bounded:
+    # during an outage we'd rather drop reports than pile them up
+    def __init__(
+        self, bot, outbound: OutboundScheduler, window: float = ERROR_DEDUP_WINDOW
+    ):
+        self.bot = bot
+        self.outbound = outbound
+        self.window = window
+        self.queue = asyncio.Queue(maxsize=ERROR_BACKLOG)
+        # fingerprint -> [window start, repeats]
+        self.seen: dict[str, list] = {}
+        # fingerprint -> [first window start, errors]: windows with repeats
+        # that a new report closed before the digest got to them
+        self.closed: dict[str, list] = {}
+        self.dropped = 0
+        self._worker: asyncio.Task | None = None
+
+    def start(self, application: Application):
+        self._worker = asyncio.create_task(self._work())
+
+    async def stop(self):
+        # the worker never returns by itself, it has to go before the loop does
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+
+    def report(self, update, context: CallbackContext):
+        fingerprint = error_fingerprint(context.error)
+        now = time.time()
+        entry = self.seen.get(fingerprint)
+        if entry is not None and entry[0] + self.window > now:
+            entry[1] += 1
+            print_log(f"{fingerprint} seen again, {entry[1]} repeats", 1)
+            return
+        if entry is not None and entry[1]:
+            # the window is over but its repeats still go in the digest
+            self.close_window(fingerprint, *entry)
+        self.seen[fingerprint] = [now, 0]
+        item = (
+            fingerprint,
+            context.error,
+            update,
+            str(context.chat_data),
+            str(context.user_data),
         )
-        return telegram_message, log_message
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            print_log(f"Error backlog full, dropped report for {fingerprint}", 1)
+
+    async def _work(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self._send_report(*item)
+            except Exception:
+                print_log(traceback.format_exc())
+                print_log(
+                    "updating developer failed... network must be down. very sad! will not retry"
+                )
+
+    async def _send_report(self, fingerprint, error, update, chat_data, user_data):
+        formatted_for_telegram, formatted_for_logs = await asyncio.to_thread(
+            self._format, error, update, chat_data, user_data
+        )
+        print_log(
+            f"updating developer with error details:\n*****\n{formatted_for_logs}\n****\n"
+        )
+        if len(formatted_for_telegram) > MAX_LEN_TELEGRAM_MESSAGE:
+            # then pick the version without tags, because sending a message without a closing
+            # tag makes telegram ANGRY
+            formatted_for_telegram = formatted_for_logs
+        messages_list = [
+            formatted_for_telegram[i : i + 4000]
+            for i in range(0, len(formatted_for_telegram), 4000)
+        ]
+        for i in messages_list:
+            await self.outbound.call(
+                ADMIN,
+                self.bot.send_message,
+                chat_id=DEVELOPER_CHAT_ID,
+                text=i,
+                parse_mode=ParseMode.HTML,
+            )
+
+    @staticmethod
+    def _format(error, update, chat_data, user_data):
+        # traceback.format_exception is list of strings.
+        tb_string = "".join(
+            traceback.format_exception(None, error, error.__traceback__)
+        )
+        # Build the message with some markup and additional information about what happened.
+        update_str = update.to_dict() if isinstance(update, Update) else str(update)
+        return format_error(update_str, chat_data, user_data, tb_string)
+
+    def close_window(self, fingerprint: str, start: float, repeats: int):
+        # the reported one plus its repeats
+        entry = self.closed.setdefault(fingerprint, [start, 0])
+        entry[1] += repeats + 1
+
+    def digest(self):
+        # compact summary of the repeats in windows that are over
+        now = time.time()
+        for fingerprint, (start, repeats) in list(self.seen.items()):
+            if start + self.window > now:
+                continue
+            del self.seen[fingerprint]
+            if repeats:
+                self.close_window(fingerprint, start, repeats)
+        lines = [
+            f"{fingerprint} x{errors} in last {round((now - start) / 60)} min"
+            for fingerprint, (start, errors) in self.closed.items()
+        ]
+        self.closed = {}
+        if self.dropped:
+            lines.append(f"{self.dropped} full reports dropped, backlog was full")
+            self.dropped = 0
+        return "\n".join(lines) or None
+
+
+class TimedRequest(HTTPXRequest):
+    # times every bot api call and counts failures by error class
+    # time.monotonic() of the last call through this one's pool
+    last_used = 0.0
+
+    async def post(self, url: str, request_data=None, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        if method == "getUpdates":
+            STARTUP.mark("first poll")
+        start = time.perf_counter()
+        try:
+            return await super().post(url, request_data, *args, **kwargs)
+        except Exception as e:
+            API_FAILURES.inc(method=method, error=type(e).__name__)
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - start, method=method)
+            self.last_used = time.monotonic()
+
+
+class OfflineRings:
+    # rings that didn't reach a chat because the network was down, waiting
+    # to be sent as one message per chat when it's back
+    def __init__(self, ttl: float = OFFLINE_RING_TTL):
+        self.ttl = ttl
+        # chat_id -> times of the rings it missed, oldest first
+        self.missed: dict[int, list[float]] = {}
+
+    def __bool__(self):
+        return bool(self.missed)
+
+    def add(self, chats, at: float):
+        for chat in chats:
+            self.missed.setdefault(chat, []).append(at)
+
+    def put_back(self, chat: int, times: list[float]):
+        self.missed[chat] = sorted(times + self.missed.get(chat, []))
+
+    def take(self):
+        # everything still within the TTL, and forgets the rest
+        cutoff = time.time() - self.ttl
+        missed, self.missed = self.missed, {}
+        missed = {
+            chat: [at for at in times if at >= cutoff] for chat, times in missed.items()
+        }
+        return {chat: times for chat, times in missed.items() if times}
+
+
+class StartupProfile:
+    # when each startup step was first reached. after a power cut, this is
+    # time the gate can't be opened
+    def __init__(self, start: float):
+        self.start = start
+        # step -> time. insertion order is the order they happened in
+        self.marks: dict[str, float] = {}
+
+    def mark(self, step: str):
+        # only the first time counts
+        if step not in self.marks:
+            self.marks[step] = time.time()
+
+    def elapsed(self, step: str):
+        return self.marks[step] - self.start
+
+    def report(self):
+        lines = []
+        previous = self.start
+        for step, at in self.marks.items():
+            lines.append(f"{step}: {at - self.start:.3f}s (+{at - previous:.3f}s)")
+            previous = at
+        return "\n".join(lines)
+
+
+class RejectionDigest:
+    # counts unauthorized requests per chat instead of telling the admin about
+    # each one. a chat seen recently hits the negative cache and costs a
+    # counter bump, no formatting, no logging
+    def __init__(self, cache_ttl: float = REJECTION_CACHE_TTL):
+        self.cache_ttl = cache_ttl
+        # chat_id -> [count, first time, last time, name]
+        self.counts: dict[int, list] = {}
+        # chat_id -> time until which it's only counted
+        self.negative_cache: dict[int, float] = {}
+
+    def record(self, update: Update):
+        chat_id = update.effective_chat.id
+        now = time.time()
+        entry = self.counts.get(chat_id)
+        if entry is not None and self.negative_cache.get(chat_id, 0) > now:
+            entry[0] += 1
+            entry[2] = now
+            return
+        name = update.effective_chat.title or update.effective_chat.username
+        print_log(f"received unauthorized request from {chat_id}({name})")
+        if entry is None:
+            self.counts[chat_id] = [1, now, now, name]
+        else:
+            entry[0] += 1
+            entry[2] = now
+        self.negative_cache[chat_id] = now + self.cache_ttl
+
+    def digest(self):
+        # text for the admin, or None if nobody knocked. resets the counts
+        now = time.time()
+        self.negative_cache = {
+            k: until for k, until in self.negative_cache.items() if until > now
+        }
+        if not self.counts:
+            return None
+        lines = [
+            f"{chat_id} ({name}): {count}x, "
+            f"{datetime.datetime.fromtimestamp(first):%d/%m %H:%M:%S} - "
+            f"{datetime.datetime.fromtimestamp(last):%H:%M:%S}"
+            for chat_id, (count, first, last, name) in sorted(
+                self.counts.items(), key=lambda item: -item[1][0]
+            )
+        ]
+        self.counts = {}
+        if len(lines) > REJECTION_DIGEST_MAX_CHATS:
+            hidden = len(lines) - REJECTION_DIGEST_MAX_CHATS
+            lines = lines[:REJECTION_DIGEST_MAX_CHATS] + [f"...and {hidden} more chats"]
+        return "Unauthorized requests since last digest:\n" + "\n".join(lines)
+
+
+class RingIntake:
+    # sits between the ring pin and the job queue. a bouncing doorbell fires
+    # a burst of edges: only the first one in each window schedules a job
+    # (with the number and time of the edge that started it), the rest are
+    # just counted. called from gpiozero's thread (or a signal handler), so
+    # no locks here: worst case a race lets two jobs through and
+    # handle_ring's own TIME_AVOID_RING check drops the second
+    def __init__(
+        self, schedule, window: float = RING_COALESCE_WINDOW, name: str = ""
+    ):
+        self.schedule = schedule
+        self.window = window
+        # the gate, for the metrics
+        self.name = name
+        self.raw_edges = 0
+        self.accepted = 0
+        self._window_start = None
+
+    def edge(self):
+        now = time.monotonic()
+        self.raw_edges += 1
+        RING_EDGES.inc(gate=self.name)
+        edge = self.raw_edges
+        accepted = (
+            self._window_start is None or now - self._window_start >= self.window
+        )
+        report_ring_event(type="edge", n=edge, at=time.time(), accepted=accepted)
+        if not accepted:
+            return False
+        self._window_start = now
+        self.accepted += 1
+        RINGS_ACCEPTED.inc(gate=self.name)
+        self.schedule(edge, time.time())
+        return True
+
+
+class GateActuator:
+    # wraps the device that opens the gate (LED or mock). the pulse is timed
+    # with asyncio.sleep instead of time.sleep, so the loop never freezes
+    def __init__(self, device, pulse_time: float = OPEN_TIME_SLEEP):
+        self.device = device
+        self.pulse_time = pulse_time
+        self._pulse: asyncio.Task | None = None
+
+    def pulse(self) -> asyncio.Task:
+        # awaitable that completes when the gate signal goes back off.
+        # asking again while a pulse is running joins the same pulse
+        if self._pulse is None or self._pulse.done():
+            self._pulse = asyncio.create_task(self._run_pulse())
+        return self._pulse
+
+    async def _run_pulse(self):
+        self.device.on()
+        try:
+            await asyncio.sleep(self.pulse_time)
+        finally:
+            # even if cancelled, never leave the gate relay on
+            self.device.off()
+
+
+class Gate:
+    # one gate: its devices and everything about it that used to be global,
+    # so a ring at one never waits for, debounces or retracts another's
+    def __init__(self, name: str, make_devices):
+        self.name = name
+        # () -> (open device, ring device). only called by connect: a
+        # standby instance must not touch the pins
+        self.make_devices = make_devices
+        self.open_dev = None
+        self.ring_dev = None
+        self.actuator: GateActuator | None = None
+        self.lock = asyncio.Lock()
+        self.lastring = 0
+        self.lastopen = 0
+        # (chat_id, message_id) -> sent at, oldest first
+        self.pending_alerts: dict[tuple[int, int], float] = {}
+        # (chat_id, message_id) -> [rings, notified at], see ring_enabled
+        self.ring_alerts: dict[tuple[int, int], list] = {}
+        self.offline_rings = OfflineRings()
+        # set by BotHandler, it needs the loop
+        self.ring_intake: RingIntake | None = None
+        # the buttons say which gate they're for
+        self.reply_markup = InlineKeyboardMarkup(
+            [
+                [
+                    InlineKeyboardButton(
+                        "Apri", callback_data=f"{name}{GATE_SEPARATOR}{OPEN}"
+                    ),
+                    InlineKeyboardButton(
+                        "Ignora", callback_data=f"{name}{GATE_SEPARATOR}{IGNORE}"
+                    ),
+                ]
+            ]
+        )
+
+    def connect(self):
+        self.open_dev, self.ring_dev = self.make_devices()
+        self.actuator = GateActuator(self.open_dev)
+        self.ring_dev.when_pressed = self.ring_intake.edge
+
+    def close(self):
+        for device in (self.open_dev, self.ring_dev):
+            if device is not None:
+                device.close()
+
+
+def load_gates(entries: list[dict], prod: bool) -> list[Gate]:
+    # the device registry: real pins on the pi, mocks anywhere else (or
+    # where "mock": true). nothing is opened until Gate.connect
+    if prod and not all(entry.get("mock") for entry in entries):
+        # only the pi has (and needs) gpiozero, and it's slow to import
+        from gpiozero import LED, Button
+    gates = []
+    for entry in entries:
+        name = entry["name"]
+        if not name or GATE_SEPARATOR in name or name in (g.name for g in gates):
+            raise ValueError(
+                f"bad gate name {name!r}: empty, repeated or with a {GATE_SEPARATOR!r}"
+            )
+        if prod and not entry.get("mock"):
+            make_devices = lambda entry=entry: (
+                LED(entry["open_pin"]),
+                Button(entry["ring_pin"]),
+            )
+        else:
+            make_devices = lambda name=name: (mock(name), mock(name))
+        gates.append(Gate(name, make_devices))
+    return gates
 
 
 class mock:
-    def __init__(self):
+    def __init__(self, name: str = "GATE"):
+        self.name = name.upper()
         self.when_pressed = None
 
     def on(self):
-        print("[MOCK GATE]I'm getting turned on...")
+        print(f"[MOCK {self.name}]I'm getting turned on...")
 
     def off(self):
-        print("[MOCK GATE]turning off...")
+        print(f"[MOCK {self.name}]turning off...")
+
+    def close(self):
+        pass
+
 
+# everything up to here is the module loading
+STARTUP = StartupProfile(SCRIPT_START)
+STARTUP.mark("imports")
 
 if __name__ == "__main__":
-    start_execution = time.time()
-    if ENV_PROD:
-        # unfortunately can't start it outside the try/catch, i need the
-        # lock to be bound to this same event loop
-        open_pin = LED(PIN_OPEN)
-        ring_pin = Button(PIN_RING)
-        handler = BotHandler(open_pin, ring_pin)
-    else:
-        handler = BotHandler(mock(), mock())
-        signal.signal(
-            signal.SIGUSR1,
-            lambda signum, n: handler.application.job_queue.run_once(
-                handler.handle_ring, 0
-            ),
-        )
-    print_log("Robobibi initialized. attempting to connect...")
-    elapsed = time.time() - start_execution
-    handler.application.job_queue.run_once(handler.first_message, 0)
-    handler.start()
+    load_tokens()
+    gates = load_gates(GATES, ENV_PROD)
+    lease = LeaderLease(LEADER_LOCK, log=print_log) if LEADER_LOCK else None
+    leading = lease is None or lease.try_acquire()
+    handler = BotHandler(gates, standby=not leading)
+    if leading or handler.stand_by(lease):
+        # only the leader gets the pins
+        for gate in gates:
+            gate.connect()
+        if not ENV_PROD:
+            write_current_pid_in_file()
+            # a fake ring: SIGUSR1 at the first gate, SIGUSR2 at the second.
+            # handled on the loop: a plain signal handler can interrupt a
+            # write to the ring report and deadlock on its queue
+            for signum, gate in zip((signal.SIGUSR1, signal.SIGUSR2), gates):
+                handler.loop.add_signal_handler(signum, gate.ring_intake.edge)
+        print_log("Robobibi initialized. attempting to connect...")
+        handler.start()
     # if loop ends with no exception, a KeyboardInterrupt was used
-    print_log("Assuming KeyboardInterrupt, exiting gracefully...")
+    if handler.exit_code == 0:
+        print_log("Assuming KeyboardInterrupt, exiting gracefully...")
     if ENV_PROD:
         print_log("Cleaning up GPIO ports...", 1)
-        if open_pin != None:
-            open_pin.close()
-        if ring_pin != None:
-            ring_pin.close()
+        for gate in gates:
+            gate.close()
+    if lease is not None:
+        lease.release()
+    print_log(
+        f"Flushing log. {LOG_WRITER.written} lines written, {LOG_WRITER.dropped} dropped",
+        1,
+    )
+    LOG_WRITER.close()
+    TRACE_WRITER.close()
+    if REPORT_WRITER is not None:
+        REPORT_WRITER.close()
+    sys.exit(handler.exit_code)
@@ -0,0 +1,375 @@
+"""
+a tiny stand-in for the telegram bot api, so the bot can be run and timed
+on a laptop without touching the real thing. implements the handful of
+methods the bot uses (getMe, getUpdates, sendMessage, editMessageText,
+answerCallbackQuery, plus the webhook housekeeping ones), with fake
+latency and error injection.
+
+point the bot at it by adding `"base_url": "http://127.0.0.1:8081/bot"`
+to tokens.json, then:
+
+    python3 fake_telegram.py --latency 0.1 --rate-429 0.05
+
+the /_control endpoints are for poking it from scripts (or curl):
+
+    POST /_inject/command   {"chat_id": 1, "command": "open_gate garage"}
+        (anything after the command goes to it as args)
+    POST /_inject/callback  {"chat_id": 1, "data": "open_notifications"}
+        (message_id defaults to the last message the bot sent to that chat)
+    POST /_config           {"latency": 0.2, "rate_timeout": 0.1, ...}
+    GET  /_calls?since=<unix time>   every api call received, with timestamps
+    GET  /_stats            call counts per method and injected errors
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_PORT = 8081
+# how long a fake timeout hangs. longer than the bot's read_timeout(30)
+TIMEOUT_DELAY = 35
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "citofbot", "username": "citofbot"}
+# methods that count as "sending" for the 429 injection
+SEND_METHODS = {"sendMessage", "editMessageText", "answerCallbackQuery"}
+
+
+class ApiError(Exception):
+    def __init__(self, code, description, parameters=None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.parameters = parameters
+
+
+class FakeTelegram:
+    def __init__(
+        self,
+        latency=0.0,
+        jitter=0.0,
+        rate_429=0.0,
+        retry_after=1,
+        rate_not_modified=0.0,
+        rate_timeout=0.0,
+        timeout_delay=TIMEOUT_DELAY,
+    ):
+        self.config = {
+            "latency": latency,
+            "jitter": jitter,
+            "rate_429": rate_429,
+            "retry_after": retry_after,
+            "rate_not_modified": rate_not_modified,
+            "rate_timeout": rate_timeout,
+            "timeout_delay": timeout_delay,
+        }
+        self.cond = threading.Condition()
+        self.updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        # (chat_id, message_id) -> text, to notice edits that change nothing
+        self.messages = {}
+        self.last_message = {}
+        self.calls = []
+        self.stats = Counter()
+        self.webhook_url = ""
+
+    ########## bot api ##########
+
+    def call(self, method, params):
+        start = time.time()
+        self.stats[method] += 1
+        try:
+            if method != "getUpdates":
+                self._misbehave(method)
+            handler = getattr(self, f"api_{method}", None)
+            if handler is None:
+                raise ApiError(404, "Not Found")
+            return handler(params)
+        finally:
+            with self.cond:
+                self.calls.append(
+                    {
+                        "method": method,
+                        "chat_id": params.get("chat_id"),
+                        "text": params.get("text"),
+                        "at": start,
+                        "duration": time.time() - start,
+                    }
+                )
+
+    def _misbehave(self, method):
+        config = self.config
+        delay = config["latency"] + random.uniform(0, config["jitter"])
+        if delay:
+            time.sleep(delay)
+        if random.random() < config["rate_timeout"]:
+            self.stats["injected_timeout"] += 1
+            time.sleep(config["timeout_delay"])
+        if method in SEND_METHODS and random.random() < config["rate_429"]:
+            self.stats["injected_429"] += 1
+            raise ApiError(
+                429,
+                f"Too Many Requests: retry after {config['retry_after']}",
+                {"retry_after": config["retry_after"]},
+            )
+        if method == "editMessageText" and random.random() < config["rate_not_modified"]:
+            self.stats["injected_not_modified"] += 1
+            raise ApiError(
+                400,
+                "Bad Request: message is not modified: specified new message content "
+                "and reply markup are exactly the same as a current content and reply "
+                "markup of the message",
+            )
+
+    def api_getMe(self, params):
+        return BOT_USER
+
+    def api_deleteWebhook(self, params):
+        self.webhook_url = ""
+        return True
+
+    def api_setWebhook(self, params):
+        # updates are still only served through getUpdates
+        self.webhook_url = params.get("url", "")
+        return True
+
+    def api_getWebhookInfo(self, params):
+        return {
+            "url": self.webhook_url,
+            "has_custom_certificate": False,
+            "pending_update_count": len(self.updates),
+        }
+
+    def api_close(self, params):
+        return True
+
+    def api_getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.time() + timeout
+        with self.cond:
+            # everything below offset is confirmed, telegram forgets it
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            while not self.updates and time.time() < deadline:
+                self.cond.wait(deadline - time.time())
+            return list(self.updates)
+
+    def api_sendMessage(self, params):
+        chat_id = int(params["chat_id"])
+        with self.cond:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+            self.messages[(chat_id, message_id)] = params["text"]
+            self.last_message[chat_id] = message_id
+        return self._message(chat_id, message_id, params["text"], params)
+
+    def api_editMessageText(self, params):
+        chat_id = int(params["chat_id"])
+        message_id = int(params["message_id"])
+        with self.cond:
+            if (chat_id, message_id) not in self.messages:
+                raise ApiError(400, "Bad Request: message to edit not found")
+            if self.messages[(chat_id, message_id)] == params["text"]:
+                raise ApiError(400, "Bad Request: message is not modified")
+            self.messages[(chat_id, message_id)] = params["text"]
+        return self._message(chat_id, message_id, params["text"], params)
+
+    def api_answerCallbackQuery(self, params):
+        return True
+
+    def _message(self, chat_id, message_id, text, params):
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "username": f"chat{chat_id}"},
+            "from": BOT_USER,
+            "text": text,
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        return message
+
+    ########## control ##########
+
+    def push_update(self, update):
+        with self.cond:
+            update["update_id"] = self.next_update_id
+            self.next_update_id += 1
+            self.updates.append(update)
+            self.cond.notify_all()
+        return update
+
+    def inject_command(self, chat_id, command, username="tester"):
+        text = f"/{command}"
+        return self.push_update(
+            {
+                "message": {
+                    "message_id": random.randint(10**6, 10**7),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private", "username": username},
+                    "from": {"id": chat_id, "is_bot": False, "first_name": username},
+                    "text": text,
+                    "entities": [
+                        # only the command itself, the rest are its args
+                        {
+                            "type": "bot_command",
+                            "offset": 0,
+                            "length": len(text.split()[0]),
+                        }
+                    ],
+                }
+            }
+        )
+
+    def inject_callback(self, chat_id, data, message_id=None, username="tester"):
+        with self.cond:
+            message_id = message_id or self.last_message.get(chat_id)
+            text = self.messages.get((chat_id, message_id), "")
+        if message_id is None:
+            raise ApiError(400, f"no message in chat {chat_id} to answer to")
+        return self.push_update(
+            {
+                "callback_query": {
+                    "id": str(random.randint(10**6, 10**7)),
+                    "from": {"id": chat_id, "is_bot": False, "first_name": username},
+                    "chat_instance": str(chat_id),
+                    "data": data,
+                    "message": self._message(chat_id, message_id, text, {}),
+                }
+            }
+        )
+
+
+def make_handler(fake: FakeTelegram):
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, like the real api
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            # one line per call would drown the interesting output
+            pass
+
+        def do_GET(self):
+            self.handle_any()
+
+        def do_POST(self):
+            self.handle_any()
+
+        def read_params(self):
+            params = {
+                k: v[-1] for k, v in parse_qs(urlparse(self.path).query).items()
+            }
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            content_type = self.headers.get("Content-Type", "")
+            if body and content_type.startswith("application/json"):
+                params.update(json.loads(body))
+            elif body:
+                params.update({k: v[-1] for k, v in parse_qs(body.decode()).items()})
+            # form values that are json (reply_markup, ...) come in as strings
+            for key in ("reply_markup", "allowed_updates"):
+                if isinstance(params.get(key), str):
+                    params[key] = json.loads(params[key])
+            return params
+
+        def reply(self, code, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def handle_any(self):
+            path = urlparse(self.path).path
+            try:
+                params = self.read_params()
+                if path.startswith("/_"):
+                    self.reply(200, self.control(path, params))
+                    return
+                # /bot<token>/<method>
+                method = path.rsplit("/", 1)[-1]
+                result = fake.call(method, params)
+                self.reply(200, {"ok": True, "result": result})
+            except ApiError as e:
+                payload = {
+                    "ok": False,
+                    "error_code": e.code,
+                    "description": e.description,
+                }
+                if e.parameters:
+                    payload["parameters"] = e.parameters
+                self.reply(e.code, payload)
+            except (BrokenPipeError, ConnectionResetError):
+                # client gave up on us (that's the point of fake timeouts)
+                pass
+
+        def control(self, path, params):
+            if path == "/_inject/command":
+                return fake.inject_command(
+                    int(params["chat_id"]), params["command"].lstrip("/")
+                )
+            if path == "/_inject/callback":
+                message_id = params.get("message_id")
+                return fake.inject_callback(
+                    int(params["chat_id"]),
+                    params["data"],
+                    int(message_id) if message_id else None,
+                )
+            if path == "/_config":
+                for key, value in params.items():
+                    if key in fake.config:
+                        fake.config[key] = float(value)
+                return fake.config
+            if path == "/_calls":
+                since = float(params.get("since") or 0)
+                with fake.cond:
+                    return [c for c in fake.calls if c["at"] >= since]
+            if path == "/_stats":
+                return dict(fake.stats)
+            raise ApiError(404, f"unknown control path {path}")
+
+    return Handler
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops connections when a broadcast opens
+    # a bunch at once, and the retry costs a whole second
+    request_queue_size = 128
+
+
+def serve(fake: FakeTelegram, port: int = DEFAULT_PORT, host: str = "127.0.0.1"):
+    return FakeServer((host, port), make_handler(fake))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="fake telegram bot api server")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="s added to each call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra s")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--rate-not-modified", type=float, default=0.0)
+    parser.add_argument("--rate-timeout", type=float, default=0.0)
+    parser.add_argument("--timeout-delay", type=float, default=TIMEOUT_DELAY)
+    args = parser.parse_args()
+
+    fake = FakeTelegram(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+        rate_not_modified=args.rate_not_modified,
+        rate_timeout=args.rate_timeout,
+        timeout_delay=args.timeout_delay,
+    )
+    server = serve(fake, args.port)
+    print(f"fake telegram listening on http://127.0.0.1:{args.port}/bot")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("bye")
@@ -0,0 +1,133 @@
+"""
+json files that can't get corrupted halfway through a write. saves go to a
+temp file, get fsynced and then renamed over the real one, off the event
+loop. a burst of saves (many addchat, a ChatMigrated storm...) becomes a
+single write. a copy of the last good version is kept next to the file
+(`<file>.bak`), and loaded if the real one doesn't parse, e.g. after a
+manual edit with a typo. so a bad file no longer means "forget every chat"
+"""
+import asyncio
+import json
+import os
+import tempfile
+import threading
+
+# how long to wait for more changes before writing
+PERSIST_COALESCE_DELAY = 0.5
+
+
+def write_atomic(path: str, data: str):
+    # a temp file of its own, two processes writing the same file (a
+    # standby, a migration...) never write into each other's
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(
+        dir=directory, prefix=f"{os.path.basename(path)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+            f.flush()
+            # mkstemp makes it 0600
+            os.fchmod(f.fileno(), 0o644)
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    # make the rename itself durable
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class JsonStore:
+    def __init__(self, path: str, coalesce_delay: float = PERSIST_COALESCE_DELAY, log=print):
+        self.path = path
+        self.backup_path = f"{path}.bak"
+        self.coalesce_delay = coalesce_delay
+        self.log = log
+        self.writes = 0
+        self.saves = 0
+        self._obj = None
+        self._pending: asyncio.Task | None = None
+        # one write at a time, even between the loop and a sync flush.
+        # the asyncio one keeps writes from the loop in order
+        self._write_lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+
+    def load(self, default_factory, snapshot: bool = True):
+        # snapshot=False only reads: for a process that doesn't own the
+        # file, e.g. a standby following the leader's saves
+        for path in (self.path, self.backup_path):
+            try:
+                with open(path) as f:
+                    obj = json.load(f)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                self.log(f"Could not load {path}: {e!r}")
+                continue
+            if path == self.backup_path:
+                self.log(f"Loaded last good snapshot {path} instead of {self.path}")
+            elif snapshot:
+                # this one parses, keep it as the snapshot to fall back to
+                self._write(self.backup_path, json.dumps(obj, indent=4))
+            return obj
+        self.log(f"Nothing to load for {self.path}, starting from default")
+        return default_factory()
+
+    def save(self, obj):
+        # schedules a write. the object is serialized when the write happens,
+        # so later changes in the same burst are picked up too
+        self._obj = obj
+        self.saves += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # no loop (startup, shutdown): just write now
+            self.flush_sync()
+            return
+        if self._pending is None or self._pending.done():
+            self._pending = loop.create_task(self._flush_later())
+
+    def discard_pending(self):
+        # forget changes not written yet, e.g. before reloading a file that
+        # was edited by hand, so they don't get written over it
+        self._obj = None
+
+    async def _flush_later(self):
+        # saves that come in while a write is running get the next one: this
+        # task isn't done yet, so save() doesn't start another
+        while self._obj is not None:
+            await asyncio.sleep(self.coalesce_delay)
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if self._obj is None:
+                return
+            # dump on the loop, where the object is mutated; write in a thread
+            data = json.dumps(self._obj, indent=4)
+            self._obj = None
+            await asyncio.to_thread(self._write_both, data)
+
+    def flush_sync(self):
+        if self._obj is None:
+            return
+        data = json.dumps(self._obj, indent=4)
+        self._obj = None
+        self._write_both(data)
+
+    def _write_both(self, data: str):
+        with self._write_lock:
+            self._write(self.path, data)
+            self._write(self.backup_path, data)
+            self.writes += 1
+
+    def _write(self, path: str, data: str):
+        try:
+            write_atomic(path, data)
+        except OSError as e:
+            self.log(f"Saving {path} failed: {e!r}")
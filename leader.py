@@ -0,0 +1,142 @@
+"""
+active/standby for two bot processes sharing a directory (same host, or a
+mount with working posix locks). whoever holds the lock on the lease file
+is the leader and runs the bot: polling, gpio, everything. the other one
+stands by, trying the lock every POLL_INTERVAL. the kernel drops the lock
+the moment the leader dies, so the standby is in charge a few tenths of a
+second later instead of after systemd's RestartSec.
+
+while leading, a thread rewrites the lease (pid, host, time) in the locked
+file every RENEW_INTERVAL, and marks it released on a clean stop. the
+standby reads it to know who it's waiting for, to notice a leader that's
+alive but stopped renewing, and, once it takes over, to tell how long
+nobody was watching the gate.
+
+    lease = LeaderLease("./leader.lock")
+    if not lease.try_acquire():
+        lease.wait(on_idle=refresh)  # blocks until we're the leader
+    ...
+    lease.release()
+"""
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+
+# how often the standby tries the lock
+POLL_INTERVAL = 0.1
+# how often the leader rewrites the lease
+RENEW_INTERVAL = 0.5
+# a lease not renewed for this long: the leader is stuck
+LEASE_TTL = 3
+# the lease is always written at this size, so there's never a truncate
+LEASE_SIZE = 256
+
+
+class LeaderLease:
+    def __init__(
+        self,
+        path: str,
+        poll_interval: float = POLL_INTERVAL,
+        renew_interval: float = RENEW_INTERVAL,
+        ttl: float = LEASE_TTL,
+        log=print,
+    ):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.renew_interval = renew_interval
+        self.ttl = ttl
+        self.log = log
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.leader = False
+        self.acquired_at = None
+        # the lease as the one before us left it, once we're the leader
+        self.previous: dict | None = None
+        self._stop = threading.Event()
+        self._renewer: threading.Thread | None = None
+
+    def read(self) -> dict | None:
+        # the lease as last written. None if there's none yet, or it was
+        # caught halfway through a write
+        try:
+            data = os.pread(self.fd, LEASE_SIZE, 0)
+            return json.loads(data) if data.strip() else None
+        except (OSError, ValueError):
+            return None
+
+    def try_acquire(self) -> bool:
+        try:
+            # lockf, not flock: posix locks also work across nfs
+            fcntl.lockf(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        self.leader = True
+        self.acquired_at = time.time()
+        self.previous = self.read()
+        self._write()
+        self._renewer = threading.Thread(
+            target=self._renew, name="lease", daemon=True
+        )
+        self._renewer.start()
+        return True
+
+    def wait(self, on_idle=None, idle_interval: float = 5):
+        # blocks until this process is the leader. on_idle gets called every
+        # idle_interval meanwhile, e.g. to keep state fresh
+        next_idle = time.monotonic() + idle_interval
+        stuck = False
+        while not self.try_acquire():
+            lease = self.read()
+            late = lease is not None and time.time() - lease["renewed_at"] > self.ttl
+            if late != stuck:
+                stuck = late
+                if late:
+                    self.log(
+                        f"Leader {describe(lease)} holds the lock but stopped "
+                        f"renewing {time.time() - lease['renewed_at']:.1f}s ago"
+                    )
+                else:
+                    self.log(f"Leader {describe(lease)} is renewing again")
+            if on_idle is not None and time.monotonic() >= next_idle:
+                on_idle()
+                next_idle = time.monotonic() + idle_interval
+            time.sleep(self.poll_interval)
+
+    def release(self):
+        # a clean stop: says so in the lease, then lets the standby in
+        if not self.leader:
+            os.close(self.fd)
+            return
+        self._stop.set()
+        self._renewer.join()
+        now = time.time()
+        self._write(renewed_at=now, released_at=now)
+        self.leader = False
+        # closing drops the lock
+        os.close(self.fd)
+
+    def _write(self, **extra):
+        lease = {
+            "pid": os.getpid(),
+            "host": socket.gethostname(),
+            "since": self.acquired_at,
+            "renewed_at": time.time(),
+            **extra,
+        }
+        os.pwrite(self.fd, json.dumps(lease).encode().ljust(LEASE_SIZE), 0)
+
+    def _renew(self):
+        while not self._stop.wait(self.renew_interval):
+            try:
+                self._write()
+            except OSError as e:
+                # the lock is still ours, only the standby's view gets stale
+                self.log(f"Could not renew the lease: {e!r}")
+
+
+def describe(lease: dict | None):
+    if lease is None:
+        return "unknown"
+    return f"pid {lease['pid']} on {lease['host']}"
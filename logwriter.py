@@ -0,0 +1,113 @@
+"""
+background log writer. handlers push lines onto a bounded queue and a
+single thread batches them to disk, so nobody on the event loop ever waits
+for the sd card. if the queue is full the line is dropped and counted,
+a stuck disk shouldn't take the doorbell down with it.
+"""
+import os
+import queue
+import threading
+
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 256
+# how long the writer waits for more lines before flushing what it has
+LOG_FLUSH_INTERVAL = 0.5
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+
+_STOP = object()
+
+
+class LogWriter:
+    def __init__(
+        self,
+        path: str,
+        max_queue: int = LOG_QUEUE_SIZE,
+        max_bytes: int = LOG_MAX_BYTES,
+        backup_count: int = LOG_BACKUP_COUNT,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.written = 0
+        self._file = None
+        self._thread = threading.Thread(
+            target=self._run, name=f"logwriter-{os.path.basename(path)}", daemon=True
+        )
+        self._closed = False
+        self._thread.start()
+
+    def write(self, line: str):
+        # never blocks. losing a log line is better than losing a ring
+        if self._closed:
+            return
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5):
+        # waits until everything queued so far hits the disk
+        done = threading.Event()
+        try:
+            self.queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5):
+        if self._closed:
+            return
+        self.flush(timeout)
+        self._closed = True
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            try:
+                # flush requests and stop don't wait for the batch to fill up
+                while len(batch) < LOG_BATCH_SIZE and isinstance(batch[-1], str):
+                    batch.append(self.queue.get(timeout=LOG_FLUSH_INTERVAL))
+            except queue.Empty:
+                pass
+            lines = [i for i in batch if isinstance(i, str)]
+            if lines:
+                self._write_lines(lines)
+            for i in batch:
+                if isinstance(i, threading.Event):
+                    i.set()
+            if any(i is _STOP for i in batch):
+                if self._file is not None:
+                    self._file.close()
+                return
+
+    def _write_lines(self, lines):
+        try:
+            if self._file is None:
+                self._file = open(self.path, "a+")
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+            self.written += len(lines)
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            # nowhere to log this but stdout
+            print(f"[LOGWRITER] failed writing {len(lines)} lines: {e}")
+            self.dropped += len(lines)
+            self._file = None
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
@@ -0,0 +1,139 @@
+"""
+bare bones prometheus metrics, so i don't need prometheus_client on the pi.
+counters, gauges (set by hand or read from a callback when scraped) and
+histograms, with labels. serve() exposes them in the text format on a
+local port, for prometheus or just curl.
+"""
+import asyncio
+import math
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = (), registry=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = {}
+        (registry if registry is not None else REGISTRY).append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += self._samples()
+        return lines
+
+    def _samples(self):
+        return [
+            f"{self.name}{_labels(self.label_names, key)} {value}"
+            for key, value in self.values.items()
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), registry=None, callback=None):
+        super().__init__(name, help, labels, registry)
+        # for unlabelled gauges that are cheaper to read than to keep updated
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def _samples(self):
+        if self.callback is not None:
+            self.values[()] = self.callback()
+        return super()._samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), registry=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            # [per bucket counts..., sum, count]
+            entry = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[i] += 1
+                break
+        entry[-2] += value
+        entry[-1] += 1
+
+    def _samples(self):
+        lines = []
+        names = self.label_names + ("le",)
+        for key, entry in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_labels(names, key + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {entry[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {entry[-1]}")
+        return lines
+
+
+REGISTRY: list[Metric] = []
+
+
+def render(registry=None):
+    lines = []
+    for metric in registry if registry is not None else REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+async def serve(host: str, port: int, registry=None):
+    # answers anything with the metrics page. it's localhost only, no routing
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # read (and ignore) the request headers
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            body = render(registry).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n".encode()
+                + b"Connection: close\r\n\r\n"
+                + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,82 @@
+"""
+every call the bot makes to telegram goes through here, with a priority:
+
+- urgent: callback answers and "opened" confirmations, someone is standing
+  at the gate waiting for them
+- alert: ring alerts and the edits that retract them
+- admin: error reports, digests, pings, command replies, startup messages
+
+each class has its own budget of calls in flight and its own queue, so an
+error report storm or a big broadcast can't take the slots the gate needs,
+and a few stuck callback answers can't hold up the ring alerts. when slots
+free up, the most urgent class is served first, then first come first served
+within a class.
+
+    await outbound.call(URGENT, bot.send_message, chat_id, "opened")
+    async with outbound.slot(ALERT):
+        ...
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+URGENT = 0
+ALERT = 1
+ADMIN = 2
+NAMES = {URGENT: "urgent", ALERT: "alert", ADMIN: "admin"}
+# calls in flight per class
+DEFAULT_BUDGETS = {URGENT: 4, ALERT: 8, ADMIN: 2}
+
+
+class OutboundScheduler:
+    def __init__(self, budgets: dict = None, on_wait=None):
+        self.budgets = dict(DEFAULT_BUDGETS if budgets is None else budgets)
+        self.in_flight = {priority: 0 for priority in self.budgets}
+        # called with (priority, seconds waited) for every call, e.g. a histogram
+        self.on_wait = on_wait
+        # priority -> futures waiting for a slot of that class, first come first
+        self._waiting = {priority: deque() for priority in self.budgets}
+
+    @asynccontextmanager
+    async def slot(self, priority: int):
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[priority].append(future)
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # got the slot just as it was cancelled, give it back
+                self._release(priority)
+            elif future in self._waiting[priority]:
+                # _wake may have dropped it already, seeing it cancelled
+                self._waiting[priority].remove(future)
+            raise
+        if self.on_wait is not None:
+            self.on_wait(priority, time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            self._release(priority)
+
+    async def call(self, priority: int, fn, *args, **kwargs):
+        async with self.slot(priority):
+            return await fn(*args, **kwargs)
+
+    def _release(self, priority: int):
+        self.in_flight[priority] -= 1
+        self._wake()
+
+    def _wake(self):
+        # hands out free slots, most urgent class first. a full class only
+        # makes its own calls wait, the others still get their slots
+        for priority in sorted(self._waiting):
+            waiting = self._waiting[priority]
+            while waiting and self.in_flight[priority] < self.budgets[priority]:
+                future = waiting.popleft()
+                if future.cancelled():
+                    continue
+                self.in_flight[priority] += 1
+                future.set_result(None)
@@ -0,0 +1,79 @@
+"""
+picks the funny line that goes with a ring or an open. built once from
+responses.json (and rebuilt when that changes), it keeps the messages
+ready to send, prefix included, and picks one in O(1). shared by the v13
+conversation bot and v21.
+
+modes:
+- uniform: any line, every time
+- weighted: lines listed in responses.json under "weights" ({"line": 3})
+  come up proportionally more often, everything else has weight 1
+- shuffle: like a bag of tiles, no repeats until every line came out once
+"""
+import random
+
+UNIFORM = "uniform"
+WEIGHTED = "weighted"
+SHUFFLE = "shuffle"
+MODES = (UNIFORM, WEIGHTED, SHUFFLE)
+WEIGHTS = "weights"
+
+
+class ResponseSelector:
+    def __init__(
+        self,
+        responses: list,
+        prefix: str,
+        default: str,
+        mode: str = UNIFORM,
+        weights: dict = None,
+        rng: random.Random = None,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"unknown response mode {mode!r}, pick one of {MODES}")
+        self.mode = mode
+        self.rng = rng or random.Random()
+        texts = [text for text in responses if text] or [default]
+        self.messages = [prefix + text for text in texts]
+        self._bag = []
+        self._last = None
+        if mode == WEIGHTED:
+            weights = weights or {}
+            self._build_alias([max(0, weights.get(text, 1)) for text in texts])
+
+    def pick(self) -> str:
+        if self.mode == SHUFFLE:
+            return self._pick_shuffle()
+        i = self.rng.randrange(len(self.messages))
+        if self.mode == WEIGHTED and self.rng.random() >= self._prob[i]:
+            i = self._alias[i]
+        return self.messages[i]
+
+    def _pick_shuffle(self):
+        if not self._bag:
+            # refilling is O(n), once every n picks
+            self._bag = list(range(len(self.messages)))
+            self.rng.shuffle(self._bag)
+            # no repeat across refills either
+            if len(self._bag) > 1 and self._bag[-1] == self._last:
+                self._bag[0], self._bag[-1] = self._bag[-1], self._bag[0]
+        self._last = self._bag.pop()
+        return self.messages[self._last]
+
+    def _build_alias(self, weights):
+        # vose's alias method: O(n) to build, O(1) per pick
+        n = len(weights)
+        total = sum(weights)
+        if total == 0:
+            weights, total = [1] * n, n
+        scaled = [w * n / total for w in weights]
+        self._prob = [1.0] * n
+        self._alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self._prob[s] = scaled[s]
+            self._alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
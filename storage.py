@@ -0,0 +1,376 @@
+"""
+where the bot keeps its state. two backends with the same interface:
+
+- JsonStorage: config.json + responses.json, like always (see jsonstore.py)
+- SqliteStorage: one sqlite db in WAL mode, with tables for chats,
+  responses, deleted responses and ring/open events. adding or removing
+  a chat touches one row instead of rewriting the whole file
+
+both also keep the unanswered ring alerts (gate, chat, message, time
+sent), so a restart doesn't leave live buttons nobody knows about
+
+version() changes when another process writes, so a standby instance
+only reloads when there's something new.
+
+the bot only calls the sync load_* and version methods at startup or while
+standing by, everything else returns immediately and does the work off the
+event loop: the sqlite connection lives in its own single thread.
+
+to move the existing files into a db (only does something on an empty db):
+
+    python3 storage.py migrate [--db citofbot.db]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from jsonstore import JsonStore
+
+JSON = "json"
+SQLITE = "sqlite"
+DEFAULT_DB = "./citofbot.db"
+# json fields, same as the bots
+ENABLED = "enabled"
+NAME = "name"
+WEIGHTS = "weights"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id INTEGER PRIMARY KEY,
+    name TEXT,
+    enabled INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS responses (
+    id INTEGER PRIMARY KEY,
+    category TEXT NOT NULL,
+    text TEXT NOT NULL,
+    weight REAL NOT NULL DEFAULT 1,
+    UNIQUE (category, text)
+);
+CREATE TABLE IF NOT EXISTS deleted_responses (
+    id INTEGER PRIMARY KEY,
+    category TEXT,
+    text TEXT NOT NULL,
+    deleted_at REAL
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    at REAL NOT NULL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS events_kind_at ON events (kind, at);
+CREATE TABLE IF NOT EXISTS pending_alerts (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    sent_at REAL NOT NULL,
+    gate TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (chat_id, message_id)
+);
+"""
+
+
+class JsonStorage:
+    def __init__(
+        self, conf_path: str, responses_path: str, pending_path: str, log=print
+    ):
+        self.conf_store = JsonStore(conf_path, log=log)
+        self.responses_store = JsonStore(responses_path, log=log)
+        self.pending_store = JsonStore(pending_path, log=log)
+        self.conf = None
+
+    def load_conf(self, snapshot: bool = True):
+        # snapshot=False: don't touch the .bak files, another process owns them
+        self.conf = self.conf_store.load(dict, snapshot)
+        return self.conf
+
+    def load_responses(self, default_factory, snapshot: bool = True):
+        return self.responses_store.load(default_factory, snapshot)
+
+    async def reload_conf(self):
+        # the file was probably edited by hand, it wins over unsaved changes
+        self.conf_store.discard_pending()
+        self.conf = await asyncio.to_thread(self.conf_store.load, dict)
+        return self.conf
+
+    async def reload_responses(self, default_factory):
+        self.responses_store.discard_pending()
+        return await asyncio.to_thread(self.responses_store.load, default_factory)
+
+    def save_chat(self, chat_id, entry: dict):
+        # the whole file gets written anyway, conf already has the change
+        self.conf_store.save(self.conf)
+
+    def remove_chat(self, chat_id):
+        self.conf_store.save(self.conf)
+
+    def record_event(self, kind: str, **detail):
+        # json files don't keep history
+        pass
+
+    def load_pending_alerts(self, snapshot: bool = True):
+        # [[chat_id, message_id, sent_at, gate], ...], oldest first. files
+        # from before gates had no gate, that's ""
+        alerts = {}
+        rows = self.pending_store.load(list, snapshot)
+        for chat_id, message_id, sent_at, *gate in rows:
+            gate = gate[0] if gate else ""
+            alerts.setdefault(gate, {})[(chat_id, message_id)] = sent_at
+        return alerts
+
+    def save_pending_alerts(self, alerts: dict):
+        # gate -> {(chat_id, message_id): sent_at}. a ring storm is one
+        # write, the store coalesces
+        self.pending_store.save(
+            [
+                [chat_id, message_id, sent_at, gate]
+                for gate, gate_alerts in alerts.items()
+                for (chat_id, message_id), sent_at in gate_alerts.items()
+            ]
+        )
+
+    def version(self):
+        # file times, the stores always replace the whole file
+        stamps = []
+        for store in (self.conf_store, self.responses_store, self.pending_store):
+            try:
+                stamps.append(os.stat(store.path).st_mtime_ns)
+            except FileNotFoundError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    async def close(self):
+        await self.conf_store.flush()
+        await self.responses_store.flush()
+        await self.pending_store.flush()
+
+
+class SqliteStorage:
+    def __init__(self, path: str = DEFAULT_DB, log=print):
+        self.path = path
+        self.log = log
+        # sqlite connections like to stay in the thread that made them
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self.db = self.executor.submit(self._connect).result()
+        self._pending = set()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL is still crash safe, it just might lose the last commit
+        # on power loss, instead of fsyncing every single one
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(SCHEMA)
+        columns = [row[1] for row in db.execute("PRAGMA table_info(pending_alerts)")]
+        if "gate" not in columns:
+            # made before gates existed
+            db.execute(
+                "ALTER TABLE pending_alerts ADD COLUMN gate TEXT NOT NULL DEFAULT ''"
+            )
+        db.commit()
+        return db
+
+    def _run(self, fn, *args):
+        return self.executor.submit(fn, *args).result()
+
+    def _submit(self, fn, *args):
+        # fire and forget from the loop. errors get logged, not raised
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, fn, *args)
+        self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self._pending.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            self.log(f"Database write failed: {future.exception()!r}")
+
+    ########## reads ##########
+
+    def _load_conf(self):
+        rows = self.db.execute("SELECT chat_id, name, enabled FROM chats").fetchall()
+        return {str(chat_id): {NAME: name, ENABLED: enabled} for chat_id, name, enabled in rows}
+
+    def _load_responses(self):
+        rows = self.db.execute(
+            "SELECT category, text, weight FROM responses ORDER BY id"
+        ).fetchall()
+        responses = {}
+        weights = {}
+        for category, text, weight in rows:
+            responses.setdefault(category, []).append(text)
+            if weight != 1:
+                weights[text] = weight
+        if weights:
+            responses[WEIGHTS] = weights
+        return responses
+
+    def _load_pending_alerts(self):
+        rows = self.db.execute(
+            "SELECT chat_id, message_id, sent_at, gate FROM pending_alerts "
+            "ORDER BY sent_at"
+        ).fetchall()
+        alerts = {}
+        for chat_id, message_id, sent_at, gate in rows:
+            alerts.setdefault(gate, {})[(chat_id, message_id)] = sent_at
+        return alerts
+
+    def load_conf(self, snapshot: bool = True):
+        # nothing to snapshot, same interface as JsonStorage
+        return self._run(self._load_conf)
+
+    def load_responses(self, default_factory, snapshot: bool = True):
+        return self._run(self._load_responses) or default_factory()
+
+    async def reload_conf(self):
+        return await asyncio.wrap_future(self.executor.submit(self._load_conf))
+
+    async def reload_responses(self, default_factory):
+        responses = await asyncio.wrap_future(self.executor.submit(self._load_responses))
+        return responses or default_factory()
+
+    def load_pending_alerts(self, snapshot: bool = True):
+        return self._run(self._load_pending_alerts)
+
+    def version(self):
+        # goes up when another connection commits, ours don't count
+        return self._run(
+            lambda: self.db.execute("PRAGMA data_version").fetchone()[0]
+        )
+
+    ########## writes ##########
+
+    def _save_chat(self, chat_id, name, enabled):
+        self.db.execute(
+            "INSERT INTO chats (chat_id, name, enabled) VALUES (?, ?, ?) "
+            "ON CONFLICT (chat_id) DO UPDATE SET name = excluded.name, "
+            "enabled = excluded.enabled",
+            (int(chat_id), name, enabled),
+        )
+        self.db.commit()
+
+    def _remove_chat(self, chat_id):
+        self.db.execute("DELETE FROM chats WHERE chat_id = ?", (int(chat_id),))
+        self.db.commit()
+
+    def _record_event(self, kind, at, detail):
+        self.db.execute(
+            "INSERT INTO events (kind, at, detail) VALUES (?, ?, ?)", (kind, at, detail)
+        )
+        self.db.commit()
+
+    def _save_pending_alerts(self, rows):
+        # a handful of rows at most, replacing them all is simpler than diffing
+        with self.db:
+            self.db.execute("DELETE FROM pending_alerts")
+            self.db.executemany(
+                "INSERT INTO pending_alerts (chat_id, message_id, sent_at, gate) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def save_chat(self, chat_id, entry: dict):
+        self._submit(self._save_chat, chat_id, entry.get(NAME), entry.get(ENABLED, 0))
+
+    def remove_chat(self, chat_id):
+        self._submit(self._remove_chat, chat_id)
+
+    def record_event(self, kind: str, **detail):
+        self._submit(self._record_event, kind, time.time(), json.dumps(detail))
+
+    def save_pending_alerts(self, alerts: dict):
+        # gate -> {(chat_id, message_id): sent_at}. copied here, on the
+        # loop, where the dicts change
+        rows = [
+            (*key, sent_at, gate)
+            for gate, gate_alerts in alerts.items()
+            for key, sent_at in gate_alerts.items()
+        ]
+        self._submit(self._save_pending_alerts, rows)
+
+    async def close(self):
+        if self._pending:
+            await asyncio.wait(list(self._pending))
+        await asyncio.wrap_future(self.executor.submit(self.db.close))
+        self.executor.shutdown()
+
+    ########## migration ##########
+
+    def _migrate(self, conf_path, responses_path, trash_path):
+        counts = {"chats": 0, "responses": 0, "deleted": 0}
+        chats = self.db.execute("SELECT count(*) FROM chats").fetchone()[0]
+        responses = self.db.execute("SELECT count(*) FROM responses").fetchone()[0]
+        if chats or responses:
+            self.log(f"{self.path} is not empty, not migrating")
+            return counts
+        with self.db:
+            if os.path.exists(conf_path):
+                with open(conf_path) as f:
+                    for chat_id, entry in json.load(f).items():
+                        self.db.execute(
+                            "INSERT INTO chats (chat_id, name, enabled) VALUES (?, ?, ?)",
+                            (int(chat_id), entry.get(NAME), entry.get(ENABLED, 0)),
+                        )
+                        counts["chats"] += 1
+            if os.path.exists(responses_path):
+                with open(responses_path) as f:
+                    data = json.load(f)
+                weights = data.get(WEIGHTS, {})
+                for category, texts in data.items():
+                    if category == WEIGHTS:
+                        continue
+                    for text in texts:
+                        self.db.execute(
+                            "INSERT OR IGNORE INTO responses (category, text, weight) "
+                            "VALUES (?, ?, ?)",
+                            (category, text, weights.get(text, 1)),
+                        )
+                        counts["responses"] += 1
+            if os.path.exists(trash_path):
+                # one deleted response per line, no category or date back then
+                with open(trash_path) as f:
+                    for line in f:
+                        if line.strip():
+                            self.db.execute(
+                                "INSERT INTO deleted_responses (text) VALUES (?)",
+                                (line.rstrip("\n"),),
+                            )
+                            counts["deleted"] += 1
+        return counts
+
+    def migrate_from_files(self, conf_path, responses_path, trash_path):
+        return self._run(self._migrate, conf_path, responses_path, trash_path)
+
+
+def make_storage(kind: str, paths, log=print):
+    # paths: anything with CONF_FILE, RESPONSE_FILE, PENDING_FILE and DB_FILE
+    if kind == SQLITE:
+        return SqliteStorage(paths.DB_FILE, log=log)
+    if kind == JSON:
+        return JsonStorage(
+            paths.CONF_FILE, paths.RESPONSE_FILE, paths.PENDING_FILE, log=log
+        )
+    raise ValueError(f"unknown storage {kind!r}, pick {JSON} or {SQLITE}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="citofbot storage tools")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--db", default=DEFAULT_DB)
+    parser.add_argument("--conf", default="./config.json")
+    parser.add_argument("--responses", default="./responses.json")
+    parser.add_argument("--trash", default="./trash.txt")
+    args = parser.parse_args()
+
+    storage = SqliteStorage(args.db)
+    counts = storage.migrate_from_files(args.conf, args.responses, args.trash)
+    storage._run(storage.db.close)
+    storage.executor.shutdown()
+    print(
+        f"migrated {counts['chats']} chats, {counts['responses']} responses and "
+        f"{counts['deleted']} deleted responses into {args.db}"
+    )
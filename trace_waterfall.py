@@ -0,0 +1,88 @@
+"""
+turns traces.jsonl (written by the bot, see tracing.py) into a waterfall
+per ring, to see which step or which chat made a ring slow.
+
+    python3 trace_waterfall.py                 # last 5 rings
+    python3 trace_waterfall.py --slowest 3     # the 3 slowest rings
+    python3 trace_waterfall.py --trace 5f0c1a  # one ring, by id prefix
+"""
+import argparse
+import datetime
+import json
+from collections import defaultdict
+
+TRACE_FILE = "./traces.jsonl"
+BAR_WIDTH = 50
+# spans in the order a ring goes through them, the rest goes after
+SPAN_ORDER = ["ring", "intake", "lock_wait", "debounce", "send", "pending_alerts"]
+
+
+def load(path):
+    traces = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            try:
+                span = json.loads(line)
+            except ValueError:
+                # half written last line, most likely
+                continue
+            traces[span["trace"]].append(span)
+    return traces
+
+
+def total(spans):
+    start = min(s["start"] for s in spans)
+    return max(s["start"] + s["duration"] for s in spans) - start
+
+
+def label(span):
+    extra = {
+        k: v for k, v in span.items() if k not in ("trace", "span", "start", "duration")
+    }
+    details = " ".join(
+        f"{k}={round(v, 3) if isinstance(v, float) else v}" for k, v in extra.items()
+    )
+    return f"{span['span']} {details}".strip()
+
+
+def waterfall(trace_id, spans):
+    start = min(s["start"] for s in spans)
+    length = total(spans) or 1e-9
+    when = datetime.datetime.fromtimestamp(start)
+    lines = [f"ring {trace_id} at {when:%Y-%m-%d %H:%M:%S.%f}, {length * 1000:.1f} ms"]
+    order = {name: i for i, name in enumerate(SPAN_ORDER)}
+    spans = sorted(spans, key=lambda s: (order.get(s["span"], len(order)), s["start"]))
+    width = max(len(label(s)) for s in spans)
+    for span in spans:
+        offset = int((span["start"] - start) / length * BAR_WIDTH)
+        size = max(1, int(span["duration"] / length * BAR_WIDTH))
+        bar = " " * offset + "#" * size
+        lines.append(
+            f"  {label(span).ljust(width)}  {bar.ljust(BAR_WIDTH + 1)} "
+            f"+{(span['start'] - start) * 1000:7.1f} ms  {span['duration'] * 1000:7.1f} ms"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="per-ring waterfall from traces")
+    parser.add_argument("--file", default=TRACE_FILE)
+    parser.add_argument("--last", type=int, default=5, help="show the last N rings")
+    parser.add_argument("--slowest", type=int, help="show the N slowest rings instead")
+    parser.add_argument("--trace", help="show the ring(s) whose id starts with this")
+    args = parser.parse_args()
+
+    traces = load(args.file)
+    if args.trace:
+        selected = [t for t in traces if t.startswith(args.trace)]
+    elif args.slowest:
+        selected = sorted(traces, key=lambda t: total(traces[t]), reverse=True)
+        selected = selected[: args.slowest]
+    else:
+        selected = sorted(traces, key=lambda t: min(s["start"] for s in traces[t]))
+        selected = selected[-args.last :]
+    if not selected:
+        print("no traces found")
+    for trace_id in selected:
+        print(waterfall(trace_id, traces[trace_id]))
+        print()
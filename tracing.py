@@ -0,0 +1,58 @@
+"""
+per-ring traces. a trace starts at the gpio edge and follows the ring
+through intake, lock, debounce, every single send and the pending alerts
+bookkeeping. each finished span is one json line:
+
+    {"trace": "5f0c...", "span": "send", "start": 1700000000.123,
+     "duration": 0.081, "chat": 1234}
+
+trace_waterfall.py turns the file back into a per-ring waterfall.
+"""
+import json
+import time
+import uuid
+from contextlib import contextmanager
+
+
+def new_trace_id():
+    # random, so no collisions across restarts like the old randint tags
+    return uuid.uuid4().hex[:16]
+
+
+class Trace:
+    def __init__(self, writer=None, trace_id: str = None, start: float = None):
+        self.trace_id = trace_id or new_trace_id()
+        self.start = start or time.time()
+        # anything with a write(str) method, usually a LogWriter. None = off
+        self.writer = writer
+
+    def __str__(self):
+        return self.trace_id
+
+    def record(self, name: str, start: float, end: float = None, **attrs):
+        if self.writer is None:
+            return
+        end = end or time.time()
+        self.writer.write(
+            json.dumps(
+                {
+                    "trace": self.trace_id,
+                    "span": name,
+                    "start": start,
+                    "duration": end - start,
+                    **attrs,
+                }
+            )
+        )
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        # attrs can be added from inside: `with trace.span(...) as attrs:`
+        start = time.time()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(name, start, **attrs)
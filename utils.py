@@ -1,15 +1,32 @@
 """
 this file helps me debug the most common problem i've had, which is
-bursts of quick requests being mishandled. i'm not sure if this should
-stay here, now that i've found the problem, but i don't really care
-enough to remove it :)
+bursts of quick requests being mishandled. it started as "fire NUM_SIG
+signals and look at the logs", now it's a small load harness: it fires
+a pattern of SIGUSR1 at the (non-prod) bot, then reads back the ring
+events the bot wrote to RING_REPORT_PATH and works out, per simulated
+ring, how long it took until the last chat was notified.
+
+    python3 utils.py                          # burst of NUM_SIG, like before
+    python3 utils.py --pattern sustained --count 30 --rate 2
+    python3 utils.py --pattern bounce --count 5 --bounces 8 --json out.json
 """
+import argparse
+import datetime
+import json
 import os
+import random
 import signal
+import statistics
+import subprocess
+import time
 
 NUM_SIG = 10
 PROCESS = 27184
 FILE_PATH = "./pid"
+# the bot appends one json line per edge and per handled ring here
+RING_REPORT_PATH = "./ring_report.jsonl"
+# time to wait after the last signal for the bot to finish broadcasting
+SETTLE_TIME = 5
 
 
 def write_current_pid_in_file():
@@ -22,7 +39,166 @@ def getcurrentpid():
         return f.readline()
 
 
-if __name__ == '__main__':
-    print("firing awayy")
-    for i in range(NUM_SIG):
-        os.kill(int(getcurrentpid()), signal.SIGUSR1)
+def burst_schedule(count, **_):
+    # everything at once, the classic
+    return [0.0] * count
+
+
+def sustained_schedule(count, rate, **_):
+    return [i / rate for i in range(count)]
+
+
+def bounce_schedule(count, bounces, jitter, gap, **_):
+    # count "presses", each one a bunch of edges a few ms apart, like a
+    # bouncing contact would produce
+    offsets = []
+    for press in range(count):
+        t = press * gap
+        for _ in range(bounces):
+            offsets.append(t)
+            t += random.uniform(0, jitter)
+    return offsets
+
+
+PATTERNS = {
+    "burst": burst_schedule,
+    "sustained": sustained_schedule,
+    "bounce": bounce_schedule,
+}
+
+
+def fire(pid, offsets):
+    # returns the wall clock time each signal was sent at
+    start = time.monotonic()
+    sent_at = []
+    for offset in offsets:
+        delay = start + offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        sent_at.append(time.time())
+        os.kill(pid, signal.SIGUSR1)
+    return sent_at
+
+
+def read_report(since):
+    edges, rings = [], {}
+    try:
+        with open(RING_REPORT_PATH) as f:
+            for line in f:
+                event = json.loads(line)
+                if event["type"] == "edge" and event["at"] >= since:
+                    edges.append(event)
+                elif event["type"] == "ring" and event["done"] >= since:
+                    # edge numbers start over at every bot restart, a ring
+                    # from an earlier run would match the wrong edge
+                    rings[event["edge"]] = event
+    except FileNotFoundError:
+        pass
+    return edges, rings
+
+
+def match_signals(sent_at, edges, rings):
+    # a signal is handled by the first edge seen after it was sent (the os
+    # merges pending signals, so a few may share an edge). an edge belongs to
+    # the ring started by the last accepted edge before it
+    accepted = [e["n"] for e in edges if e["accepted"]]
+    results = []
+    i = 0
+    for t in sent_at:
+        while i < len(edges) and edges[i]["at"] < t:
+            i += 1
+        record = {"sent_at": t, "edge": None, "ring": None, "latency": None}
+        if i < len(edges):
+            edge = edges[i]["n"]
+            record["edge"] = edge
+            owners = [n for n in accepted if n <= edge]
+            ring = rings.get(owners[-1]) if owners else None
+            if ring is not None:
+                record["ring"] = ring["edge"]
+                if ring["sent"] > 0:
+                    record["latency"] = ring["done"] - t
+        results.append(record)
+    return results
+
+
+def summarize(signals, edges, rings):
+    handled_rings = [r for r in rings.values() if r["edge"] in {e["n"] for e in edges}]
+    latencies = sorted(s["latency"] for s in signals if s["latency"] is not None)
+
+    def pct(p):
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+    return {
+        "signals": len(signals),
+        "edges": len(edges),
+        "accepted": sum(1 for e in edges if e["accepted"]),
+        "broadcasts": sum(1 for r in handled_rings if r["sent"] > 0),
+        "suppressed": sum(1 for r in handled_rings if r["sent"] == 0),
+        "notifications": sum(r["sent"] for r in handled_rings),
+        "notified_signals": len(latencies),
+        "latency_p50": pct(0.5),
+        "latency_p95": pct(0.95),
+        "latency_max": latencies[-1] if latencies else None,
+        "latency_mean": statistics.mean(latencies) if latencies else None,
+    }
+
+
+def print_table(summary):
+    width = max(len(k) for k in summary)
+    for key, value in summary.items():
+        if isinstance(value, float):
+            value = f"{value * 1000:.1f} ms"
+        print(f"{key.ljust(width)}  {value}")
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="fire fake rings at the bot")
+    parser.add_argument("--pattern", choices=PATTERNS, default="burst")
+    parser.add_argument("--count", type=int, default=NUM_SIG)
+    parser.add_argument("--rate", type=float, default=1, help="signals/s (sustained)")
+    parser.add_argument("--bounces", type=int, default=5, help="edges per press (bounce)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="max s between bounces")
+    parser.add_argument("--gap", type=float, default=20, help="s between presses (bounce)")
+    parser.add_argument("--settle", type=float, default=SETTLE_TIME)
+    parser.add_argument("--json", help="where to write the full report")
+    args = parser.parse_args()
+
+    pid = int(getcurrentpid())
+    offsets = PATTERNS[args.pattern](**vars(args))
+    print(f"firing awayy: {len(offsets)} signals at {pid} ({args.pattern})")
+    start = time.time()
+    sent_at = fire(pid, offsets)
+    time.sleep(args.settle)
+
+    edges, rings = read_report(start)
+    signals = match_signals(sent_at, edges, rings)
+    summary = summarize(signals, edges, rings)
+    print_table(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "commit": current_commit(),
+                    "date": str(datetime.datetime.now()),
+                    "args": vars(args),
+                    "summary": summary,
+                    "signals": signals,
+                },
+                f,
+                indent=4,
+            )
+        print(f"report written to {args.json}")